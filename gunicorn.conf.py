@@ -0,0 +1,15 @@
+# Настройки gunicorn для docker-compose.prod.yml. По умолчанию WSGI-воркеры с потоками, под ASGI:
+# GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker и приложение nomia.asgi:application
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# Перезапуск воркеров через случайное число запросов, чтобы они не перезапускались одновременно
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+timeout = 30
+keepalive = 5
+accesslog = "-"
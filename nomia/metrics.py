@@ -0,0 +1,174 @@
+"""
+Замеры запросов: число и время SQL-запросов и общее время обработки по views. Результаты отдаются
+в заголовке Server-Timing, копятся в гистограммах процесса для /metrics и пишутся в лог для медленных запросов.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger("nomia")
+
+SLOW_SQL_LIMIT = 50  # Сколько самых долгих SQL-запросов запроса хранить для лога медленных запросов
+
+
+class RequestStats:
+    """SQL-запросы одного запроса к сайту"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = []  # Куча (время, номер, sql) из SLOW_SQL_LIMIT самых долгих запросов
+
+    def add(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        statement = (duration, self.queries, sql)
+        if len(self.statements) < SLOW_SQL_LIMIT:
+            heapq.heappush(self.statements, statement)
+        else:
+            heapq.heappushpop(self.statements, statement)
+
+    def slowest(self):
+        """Самые долгие запросы, начиная с самого долгого: [(время, sql)]"""
+        return [(duration, sql) for duration, _, sql in sorted(self.statements, reverse=True)]
+
+
+_stats = ContextVar('request_stats', default=None)
+
+
+def record_sql(execute, sql, params, many, context):
+    """execute_wrapper, который считает запросы текущего запроса к сайту"""
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - start)
+
+
+def install_wrapper(connection, **kwargs):
+    """
+    Добавляет record_sql в соединение. Асинхронные views ходят в базу из других потоков со своими
+    соединениями, поэтому обертка ставится на каждое новое соединение, а запросы относятся к запросу
+    к сайту через contextvars.
+    """
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+connection_created.connect(install_wrapper)
+
+
+class Histogram:
+    """Гистограмма в памяти процесса с метками по имени view"""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.values = {}  # view: [счетчики по корзинам, сумма, количество]
+        self.lock = threading.Lock()
+
+    def observe(self, view, value):
+        with self.lock:
+            counts, total, count = self.values.get(view) or ([0] * len(self.buckets), 0.0, 0)
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += 1
+            self.values[view] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            values = sorted(self.values.items())
+        for view, (counts, total, count) in values:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{view="{view}",le="{bucket}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{view="{view}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {count}')
+        return lines
+
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+request_duration = Histogram('nomia_request_duration_seconds', 'Request processing time.', TIME_BUCKETS)
+sql_duration = Histogram('nomia_request_sql_duration_seconds', 'SQL time per request.', TIME_BUCKETS)
+sql_queries = Histogram('nomia_request_sql_queries', 'SQL queries per request.', (1, 2, 5, 10, 20, 50, 100, 200))
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+def finish_request(request, response, stats):
+    """Записывает замеры запроса в заголовок, гистограммы и лог медленных запросов"""
+    total = time.perf_counter() - stats.start
+    view = view_name(request)
+    response['Server-Timing'] = (f'sql;dur={stats.sql_time * 1000:.1f};desc="{stats.queries} queries", '
+                                 f'total;dur={total * 1000:.1f}')
+    request_duration.observe(view, total)
+    sql_duration.observe(view, stats.sql_time)
+    sql_queries.observe(view, stats.queries)
+    if settings.METRICS_SLOW_REQUEST_MS and total * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+        statements = '\n'.join(f'  {duration * 1000:.1f} ms: {sql}' for duration, sql in stats.slowest())
+        logger.warning(f'Slow request {request.method} {request.path} ({view}): {total * 1000:.1f} ms, '
+                       f'{stats.queries} queries, SQL {stats.sql_time * 1000:.1f} ms\n{statements}')
+
+
+class MetricsMiddleware:
+    """Считает SQL-запросы и время обработки каждого запроса. Должен стоять первым в MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _stats.set(stats)
+        try:
+            for connection in connections.all(initialized_only=True):
+                install_wrapper(connection)
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        finish_request(request, response, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        finish_request(request, response, stats)
+        return response
+
+
+def metrics(request):
+    """Гистограммы процесса в текстовом формате Prometheus, доступны с адресов METRICS_ALLOWED_IPS и сотрудникам"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponseForbidden()
+    lines = []
+    for histogram in (request_duration, sql_duration, sql_queries):
+        lines.extend(histogram.render())
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
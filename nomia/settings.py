@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'nomia.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,6 +90,17 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -127,6 +139,40 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static',]
 
+# Способ поиска следующего вопроса: "tree" - дерево опроса в памяти процесса, "sql" - один запрос к базе,
+# "loop" - перебор вопросов с запросом условий для каждого из них
+POLLS_NEXT_QUESTION_ENGINE = os.environ.get("POLLS_NEXT_QUESTION_ENGINE", "tree")
+
+# Сохранять результаты пользователя по завершении опроса, чтобы страница результатов читала одну строку
+POLLS_RESULT_SNAPSHOTS = bool(int(os.environ.get("POLLS_RESULT_SNAPSHOTS", default=1)))
+
+# Асинхронные views прохождения опросов, имеет смысл только при запуске под ASGI (uvicorn)
+POLLS_ASYNC_VIEWS = bool(int(os.environ.get("POLLS_ASYNC_VIEWS", default=0)))
+
+# Кэш для отрендеренных форм вопросов, ключи содержат версию опроса и не требуют времени жизни
+POLLS_FRAGMENT_CACHE = os.environ.get("POLLS_FRAGMENT_CACHE", "default")
+
+# Постраничный вывод списка опросов: "pages" - по номеру страницы, "keyset" - по ключу без подсчета всех опросов
+POLLS_LIST_PAGINATION = os.environ.get("POLLS_LIST_PAGINATION", "pages")
+# Кэшировать id опросов, пройденных пользователем, в кэше POLLS_FRAGMENT_CACHE
+POLLS_CACHE_COMPLETED_POLLS = bool(int(os.environ.get("POLLS_CACHE_COMPLETED_POLLS", default=0)))
+# Файл журнала ответов для отложенной записи (polls/journal.py), пустая строка - ответы пишутся в базу сразу
+POLLS_ANSWER_JOURNAL = os.environ.get("POLLS_ANSWER_JOURNAL", "")
+# Каталог с архивами ответов на закрытые опросы (polls/archive.py)
+POLLS_ARCHIVE_DIR = os.environ.get("POLLS_ARCHIVE_DIR", BASE_DIR / "archive")
+# Сколько матриц ответов (polls/analytics.py) держать в памяти процесса
+POLLS_ANALYTICS_CACHE_SIZE = int(os.environ.get("POLLS_ANALYTICS_CACHE_SIZE", default=4))
+# Поток счетчиков опроса (polls/live.py): как часто читать счетчики, как часто отправлять keepalive
+# и через сколько секунд без новых ответов закрывать поток
+POLLS_LIVE_INTERVAL = float(os.environ.get("POLLS_LIVE_INTERVAL", default=1.0))
+POLLS_LIVE_KEEPALIVE = float(os.environ.get("POLLS_LIVE_KEEPALIVE", default=15.0))
+POLLS_LIVE_IDLE_TIMEOUT = float(os.environ.get("POLLS_LIVE_IDLE_TIMEOUT", default=600.0))
+
+# Запросы дольше стольких миллисекунд пишутся в лог вместе с их SQL, 0 - не писать
+METRICS_SLOW_REQUEST_MS = int(os.environ.get("METRICS_SLOW_REQUEST_MS", default=500))
+# Адреса, которым доступен /metrics (адрес сборщика метрик), кроме них /metrics доступен только сотрудникам
+METRICS_ALLOWED_IPS = os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1 ::1").split()
+
 LOGIN_REDIRECT_URL = '/polls/'
 LOGOUT_REDIRECT_URL = '/login/'
 LOGIN_URL = '/login/'
@@ -148,6 +194,10 @@ LOGGING = {
             'level': 'DEBUG',
             'filters': ['require_debug_true'],
             'class': 'logging.StreamHandler',
+        },
+        'warnings': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
         }
     },
     'loggers': {
@@ -158,6 +208,10 @@ LOGGING = {
         'polls': {
             'level': 'DEBUG',
             'handlers': ['console'],
+        },
+        'nomia': {
+            'level': 'WARNING',
+            'handlers': ['warnings'],
         }
     }
 }
@@ -0,0 +1,29 @@
+"""
+Настройки для продакшена, включаются DJANGO_SETTINGS_MODULE=nomia.settings_production.
+Отличия от nomia/settings.py: соединения с базой переиспользуются, сессии читаются из общего кэша,
+статика с хешами в именах отдается сжатой через whitenoise с кэшированием в браузере навсегда.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# Соединения с базой держатся открытыми CONN_MAX_AGE секунд. Под ASGI запросы выполняются в разных потоках
+# и постоянные соединения там копятся, поэтому под ASGI нужен CONN_MAX_AGE=0
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get("CONN_MAX_AGE", default=600))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True  # Проверять переиспользуемое соединение перед запросом
+
+# Кэш процесса не подходит: у каждого воркера была бы своя копия сессий, форм вопросов и пройденных опросов,
+# а сброс кэша в одном воркере не виден остальным
+if CACHES['default']['BACKEND'] == "django.core.cache.backends.locmem.LocMemCache":
+    raise ImproperlyConfigured("Production settings need a shared cache, set CACHE_BACKEND and CACHE_LOCATION.")
+# Сессии читаются из кэша, в базу только записываются
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+
+# Статика собирается collectstatic с хешами в именах и сжатыми копиями (gzip, brotli)
+MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                  'whitenoise.middleware.WhiteNoiseMiddleware')
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
@@ -19,10 +19,12 @@ from django.urls import path, include
 from django.contrib.auth import views as auth_views
 from django.conf.urls.static import static
 from django.conf import settings
+from nomia.metrics import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/', auth_views.LoginView.as_view(template_name='login.html')),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     path('polls/', include('polls.urls')),
+    path('metrics', metrics),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,37 +1,264 @@
+from urllib.parse import urlsplit, parse_qs
 from django.contrib import admin, messages
-from .models import Choice, Poll, Question, Condition, PollResult
+from django.db import transaction
+from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse, resolve, Resolver404
+from django.utils.html import format_html
+from django.db.models import Prefetch
+from .models import Choice, Poll, Question, Condition
+from .stats import poll_statistics
+from .analytics import poll_analytics
+from .tree import compile_poll_trees
 from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
 
 
 @admin.register(Poll)
 class PollAdmin(admin.ModelAdmin):
-    list_display = ['__str__', 'visibility']
+    list_display = ['__str__', 'visibility', 'archived', 'statistics_link', 'analytics_link', 'conditions_link']
+    search_fields = ['name']
     actions = ["make_visible"]
 
     @admin.action(description="Mark selected polls as visible")
     def make_visible(self, request, queryset):
-        try:
-            for poll in queryset:
-                poll.visibility = True
-                poll.full_clean()
-        except ValidationError as e:
-            messages.error(request, '\n'.join(e.messages))
+        """Показывает выбранные опросы, только если все они проходят проверку"""
+        errors = Poll.validate_polls(queryset)
+        if errors:
+            for poll_errors in errors.values():
+                messages.error(request, '\n'.join(poll_errors))
         else:
             queryset.update(visibility=True)
+            self.warn_dead_questions(request, queryset)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if obj.visibility:
+            self.warn_dead_questions(request, [obj])
+
+    def warn_dead_questions(self, request, polls):
+        """Предупреждает о вопросах, которые не увидит ни один пользователь. Деревья строятся за три запроса"""
+        trees = compile_poll_trees(polls)
+        for poll in polls:
+            dead = trees[poll.id].dead
+            if dead:
+                messages.warning(request, f"Questions {', '.join(str(question_id) for question_id in sorted(dead))} "
+                                          f"of poll {poll} can never be shown.")
+
+    @admin.display(description="Statistics")
+    def statistics_link(self, obj):
+        return format_html('<a href="{}">Statistics</a>', reverse('admin:polls_poll_statistics', args=[obj.pk]))
+
+    @admin.display(description="Analytics")
+    def analytics_link(self, obj):
+        return format_html('<a href="{}">Analytics</a>', reverse('admin:polls_poll_analytics', args=[obj.pk]))
+
+    @admin.display(description="Conditions")
+    def conditions_link(self, obj):
+        return format_html('<a href="{}">Conditions</a>', reverse('admin:polls_poll_conditions', args=[obj.pk]))
+
+    def get_urls(self):
+        return [
+            path('<int:poll_id>/conditions/', self.admin_site.admin_view(self.conditions_view),
+                 name='polls_poll_conditions'),
+            path('<int:poll_id>/statistics/', self.admin_site.admin_view(self.statistics_view),
+                 name='polls_poll_statistics'),
+            path('<int:poll_id>/analytics/', self.admin_site.admin_view(self.analytics_view),
+                 name='polls_poll_analytics'),
+        ] + super().get_urls()
+
+    def statistics_view(self, request, poll_id):
+        """Статистика опроса по счетчикам, время ответа не зависит от числа ответов"""
+        poll = get_object_or_404(Poll, pk=poll_id)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "original": poll,
+            "title": f"Statistics: {poll}",
+            "statistics": poll_statistics(poll),
+        }
+        return TemplateResponse(request, "admin/polls/poll/statistics.html", context)
+
+    def analytics_view(self, request, poll_id):
+        """
+        Распределения ответов в сегменте респондентов и таблица сопряженности двух вопросов.
+        Параметры: include и exclude - id choices сегмента, row и column - id вопросов таблицы.
+        """
+        poll = get_object_or_404(Poll, pk=poll_id)
+        try:
+            include = [int(choice_id) for choice_id in request.GET.getlist('include')]
+            exclude = [int(choice_id) for choice_id in request.GET.getlist('exclude')]
+            row, column = (int(request.GET[name]) if request.GET.get(name) else None for name in ('row', 'column'))
+            analytics = poll_analytics(poll, include, exclude, row, column)
+        except (ValueError, KeyError) as e:
+            messages.error(request, f"Wrong analytics parameters: {e}")
+            include, exclude, row, column = [], [], None, None
+            analytics = poll_analytics(poll)
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "original": poll,
+            "title": f"Analytics: {poll}",
+            "analytics": analytics,
+            "questions": Question.objects.filter(poll=poll).prefetch_related('choice_set'),
+            "include": include,
+            "exclude": exclude,
+            "row": row,
+            "column": column,
+        }
+        return TemplateResponse(request, "admin/polls/poll/analytics.html", context)
+
+    def conditions_view(self, request, poll_id):
+        """
+        Условия показа всех вопросов опроса одной таблицей: строки - вопросы, колонки - choices предыдущих
+        вопросов. Сохраняются одной транзакцией, если опрос не изменился с момента открытия страницы.
+        """
+        poll = get_object_or_404(Poll, pk=poll_id)
+        questions = list(Question.objects.filter(poll=poll).order_by('id').prefetch_related(
+            Prefetch('choice_set', queryset=Choice.objects.order_by('id'))))
+        if request.method == 'POST':
+            try:
+                conditions = {}
+                for name, value in request.POST.items():
+                    if name.startswith('condition_') and value:
+                        question_id, choice_id = (int(part) for part in name.removeprefix('condition_').split('_'))
+                        conditions[(question_id, choice_id)] = {"show": True, "hide": False}[value]
+                save_conditions(poll, questions, int(request.POST['version']), conditions)
+            except (ValueError, KeyError):
+                messages.error(request, "Wrong conditions form.")
+            except ValidationError as e:
+                messages.error(request, '\n'.join(e.messages))
+            else:
+                messages.success(request, f"Conditions of poll {poll} were saved.")
+                poll.refresh_from_db()
+                self.warn_dead_questions(request, [poll])
+                return redirect('admin:polls_poll_conditions', poll.id)
+        current = {(question_id, choice_id): condition_type for question_id, choice_id, condition_type in
+                   Condition.objects.filter(question__poll=poll).values_list('question_id', 'choice_id',
+                                                                            'condition_type')}
+        choices = [choice for question in questions for choice in question.choice_set.all()]
+        rows = [{"question": question, "cells": [
+            {"name": f"condition_{question.id}_{choice.id}",
+             "value": {True: "show", False: "hide"}.get(current.get((question.id, choice.id)), "")}
+            if choice.question_id < question.id else None for choice in choices
+        ]} for question in questions]
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "original": poll,
+            "title": f"Conditions: {poll}",
+            "version": poll.version,
+            "questions": questions,
+            "rows": rows,
+        }
+        return TemplateResponse(request, "admin/polls/poll/conditions.html", context)
+
+
+def save_conditions(poll, questions, version, conditions):
+    """
+    Заменяет условия опроса на conditions {(question_id, choice_id): condition_type} одной транзакцией.
+    Записываются только изменения: измененные и новые условия пачками, без сигналов на каждое условие.
+    """
+    order = {choice.id: question.id for question in questions for choice in question.choice_set.all()}
+    foreign = sorted({question_id for question_id, _ in conditions} - {question.id for question in questions})
+    if foreign:
+        raise ValidationError(f"Questions {foreign} are not from poll {poll}.")
+    wrong = sorted(choice_id for question_id, choice_id in conditions
+                   if choice_id not in order or order[choice_id] >= question_id)
+    if wrong:
+        raise ValidationError(f"Choices {wrong} are not from earlier questions of poll {poll}.")
+    with transaction.atomic():
+        if Poll.objects.select_for_update().filter(pk=poll.pk).values_list('version', flat=True).get() != version:
+            raise ValidationError(f"Poll {poll} was changed by someone else, reload the page.")
+        current = {(condition.question_id, condition.choice_id): condition
+                   for condition in Condition.objects.filter(question__poll=poll)}
+        removed = [condition.id for key, condition in current.items() if key not in conditions]
+        changed = []
+        for key, condition_type in conditions.items():
+            if key in current and current[key].condition_type != condition_type:
+                current[key].condition_type = condition_type
+                changed.append(current[key])
+        added = [Condition(question_id=question_id, choice_id=choice_id, condition_type=condition_type)
+                 for (question_id, choice_id), condition_type in conditions.items() if (question_id, choice_id)
+                 not in current]
+        Condition.objects.filter(id__in=removed).delete()
+        Condition.objects.bulk_update(changed, ['condition_type'], batch_size=500)
+        Condition.objects.bulk_create(added, batch_size=500)
+        Poll.bump_version(pk=poll.pk)
+
+
+def referring_question(request):
+    """Вопрос, с формы которого запрошено автодополнение: из адреса страницы вопроса или условия"""
+    referer = urlsplit(request.headers.get('Referer', ''))
+    try:
+        match = resolve(referer.path)
+    except Resolver404:
+        return None
+    if match.url_name == 'polls_question_change':
+        return Question.objects.filter(pk=match.kwargs['object_id']).first()
+    if match.url_name == 'polls_condition_change':
+        return Question.objects.filter(condition__pk=match.kwargs['object_id']).first()
+    if match.url_name == 'polls_condition_add':
+        question_id = parse_qs(referer.query).get('question', [''])[0]
+        return Question.objects.filter(pk=question_id).first() if question_id.isdigit() else None
+    return None
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
 
 
+class ConditionInline(admin.TabularInline):
+    model = Condition
+    autocomplete_fields = ['choice']
+    extra = 1
+
+
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
     list_display = ['__str__', 'choice_type', 'poll', 'default']
+    list_select_related = ['poll']
+    list_filter = ['choice_type', 'default']
+    search_fields = ['text']
+    autocomplete_fields = ['poll']
     inlines = [
         ChoiceInline,
+        ConditionInline,
     ]
 
+    def get_inlines(self, request, obj):
+        """Условия добавляются к сохраненному вопросу: до сохранения не с чем сравнить порядок вопросов"""
+        return [ChoiceInline] if obj is None else self.inlines
+
+    def get_search_results(self, request, queryset, search_term):
+        """Автодополнение вопроса условия предлагает только вопросы опроса, с которым работают"""
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        question = referring_question(request) if request.GET.get('model_name') == 'condition' else None
+        if question is not None:
+            queryset = queryset.filter(poll_id=question.poll_id)
+        return queryset, may_have_duplicates
+
+
+@admin.register(Choice)
+class ChoiceAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'question']
+    list_select_related = ['question']
+    ordering = ['id']
+    search_fields = ['text', 'question__text']
+    autocomplete_fields = ['question']
+
+    def get_search_results(self, request, queryset, search_term):
+        """Автодополнение choice условия предлагает только choices предыдущих вопросов того же опроса"""
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        question = referring_question(request) if request.GET.get('model_name') == 'condition' else None
+        if question is not None:
+            queryset = queryset.filter(question__poll_id=question.poll_id, question_id__lt=question.id)
+        return queryset, may_have_duplicates
+
 
 @admin.register(Condition)
 class ConditionAdmin(admin.ModelAdmin):
     list_display = ['condition_type', 'question', 'choice']
+    list_select_related = ['question', 'choice']
+    list_filter = ['condition_type']
+    search_fields = ['question__text', 'choice__text']
+    autocomplete_fields = ['question', 'choice']
@@ -0,0 +1,184 @@
+"""
+Аналитика ответов на опрос: матрица респондент x choice строится одним потоковым запросом (или по архиву
+опроса), срезы считаются векторно через numpy. Матрицы хранятся в ограниченном LRU-кэше процесса
+по ключу (опрос, версия, число ответов из PollCounter, число и последний id PollResult), поэтому новые
+ответы, удаление респондентов и изменения вопросов строят матрицу заново. Нужен numpy.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Subquery
+from .models import Poll, Question, Choice, Answer, PollResult, PollCounter
+from .archive import require_numpy, open_archive
+import logging
+
+logger = logging.getLogger("polls")
+
+
+@dataclass(frozen=True, slots=True)
+class ResponseMatrix:
+    """
+    matrix[i, j] - выбрал ли респондент results[i] choice choices[j]. Колонки упорядочены по вопросам,
+    columns[question_id] - срез колонок вопроса. Респонденты без ответов в матрицу не попадают.
+    """
+    key: tuple
+    results: object
+    choices: object
+    columns: dict
+    matrix: object
+
+    @property
+    def respondents(self):
+        return len(self.results)
+
+    def _choice_columns(self, choice_ids):
+        index = {choice_id: column for column, choice_id in enumerate(self.choices.tolist())}
+        unknown = [choice_id for choice_id in choice_ids if choice_id not in index]
+        if unknown:
+            raise KeyError(f"Choices {unknown} are not in the poll.")
+        return [index[choice_id] for choice_id in choice_ids]
+
+    def segment(self, include=(), exclude=()):
+        """Маска респондентов, выбравших все choices из include и ни одного из exclude"""
+        mask = require_numpy().ones(self.respondents, dtype=bool)
+        if include:
+            mask &= self.matrix[:, self._choice_columns(include)].all(axis=1)
+        if exclude:
+            mask &= ~self.matrix[:, self._choice_columns(exclude)].any(axis=1)
+        return mask
+
+    def _rows(self, mask):
+        return self.matrix if mask is None else self.matrix[mask]
+
+    def counts(self, mask=None):
+        """Сколько респондентов (из маски) выбрали каждый choice: {choice_id: число}"""
+        return dict(zip(self.choices.tolist(), self._rows(mask).sum(axis=0).tolist()))
+
+    def distribution(self, question_id, mask=None):
+        """
+        Распределение ответов на вопрос среди респондентов из маски, ответивших на него:
+        (число ответивших, {choice_id: доля})
+        """
+        answers = self._rows(mask)[:, self.columns[question_id]]
+        answered = int(answers.any(axis=1).sum())
+        shares = answers.sum(axis=0) / max(answered, 1)
+        return answered, dict(zip(self.choices[self.columns[question_id]].tolist(), shares.tolist()))
+
+    def crosstab(self, row_question_id, column_question_id, mask=None):
+        """Таблица сопряженности двух вопросов: [i][j] - сколько респондентов выбрали оба choices"""
+        rows = self._rows(mask)
+        numpy = require_numpy()
+        return (rows[:, self.columns[row_question_id]].T.astype(numpy.int64)
+                @ rows[:, self.columns[column_question_id]].astype(numpy.int64))
+
+
+def _answer_pairs(poll, chunk_size):
+    """Массивы (result_id, choice_id) ответов опроса: из архива или одним потоковым запросом"""
+    numpy = require_numpy()
+    if poll.archived:
+        archive = open_archive(poll.id)
+        return archive['result'], archive['choice']
+    results, choices = array('q'), array('q')
+    for result_id, choice_id in (Answer.objects.filter(poll_result__poll=poll).order_by()
+                                 .values_list('poll_result_id', 'choice_id').iterator(chunk_size=chunk_size)):
+        results.append(result_id)
+        choices.append(choice_id)
+    return numpy.frombuffer(results, dtype=numpy.int64), numpy.frombuffer(choices, dtype=numpy.int64)
+
+
+def build_matrix(poll, key=None, chunk_size=10000):
+    """Строит матрицу ответов опроса: запрос choices и один потоковый запрос ответов"""
+    numpy = require_numpy()
+    columns, choice_ids = {}, []
+    for question_id, choice_id in (Choice.objects.filter(question__poll=poll).order_by('question_id', 'id')
+                                   .values_list('question_id', 'id')):
+        start = columns[question_id].start if question_id in columns else len(choice_ids)
+        choice_ids.append(choice_id)
+        columns[question_id] = slice(start, len(choice_ids))
+    choices = numpy.array(choice_ids, dtype=numpy.int64)
+    result_ids, answer_choices = _answer_pairs(poll, chunk_size)
+    results, rows = numpy.unique(result_ids, return_inverse=True)
+    # Номер колонки по id choice, ответы на удаленные из опроса choices пропускаются
+    lookup = numpy.full(max(choice_ids + [int(answer_choices.max()) if len(answer_choices) else 0]) + 1, -1)
+    lookup[choices] = numpy.arange(len(choices))
+    answer_columns = lookup[answer_choices]
+    known = answer_columns >= 0
+    matrix = numpy.zeros((len(results), len(choices)), dtype=bool)
+    matrix[rows[known], answer_columns[known]] = True
+    return ResponseMatrix(key=key, results=results, choices=choices, columns=columns, matrix=matrix)
+
+
+_matrices = OrderedDict()
+_matrices_lock = threading.Lock()  # Под потоковыми воркерами кэш меняют несколько потоков
+
+
+def matrix_key(poll):
+    """
+    Версия опроса, число ответов из PollCounter, число и последний id PollResult одним запросом:
+    счетчик растет с новыми ответами, а удаление респондентов меняет число PollResult
+    """
+    results = PollResult.objects.filter(poll=OuterRef('pk')).order_by().values('poll')
+    counts = Poll.objects.filter(pk=poll.pk).values_list(
+        Subquery(PollCounter.objects.filter(poll=OuterRef('pk')).values('answers')),
+        Subquery(results.annotate(number=Count('id')).values('number')),
+        Subquery(results.annotate(last=Max('id')).values('last'))).first()
+    return poll.id, poll.version, *(counts or ())
+
+
+def get_matrix(poll):
+    """Матрица ответов опроса из LRU-кэша процесса на settings.POLLS_ANALYTICS_CACHE_SIZE матриц"""
+    key = matrix_key(poll)
+    with _matrices_lock:
+        matrix = _matrices.get(poll.id)
+        if matrix is not None and matrix.key == key:
+            _matrices.move_to_end(poll.id)
+            return matrix
+    matrix = build_matrix(poll, key)  # Строится без блокировки, чтобы не ждать матриц других опросов
+    logger.debug(f'Build response matrix of poll_{poll.id}: {matrix.respondents} x {len(matrix.choices)}')
+    with _matrices_lock:
+        _matrices[poll.id] = matrix
+        _matrices.move_to_end(poll.id)
+        while len(_matrices) > settings.POLLS_ANALYTICS_CACHE_SIZE:
+            _matrices.popitem(last=False)
+    return matrix
+
+
+def forget_matrix(poll_id):
+    with _matrices_lock:
+        _matrices.pop(poll_id, None)
+
+
+def poll_analytics(poll, include=(), exclude=(), row_question=None, column_question=None):
+    """
+    Распределения ответов на вопросы опроса в сегменте респондентов (выбрали все include и ни одного
+    из exclude) и, если заданы оба вопроса, их таблица сопряженности
+    """
+    matrix = get_matrix(poll)
+    mask = matrix.segment(include, exclude)
+    questions = list(Question.objects.filter(poll=poll).prefetch_related('choice_set'))
+    texts = {choice.id: choice.text for question in questions for choice in question.choice_set.all()}
+    counts = matrix.counts(mask)
+    report = {"respondents": matrix.respondents, "segment": int(mask.sum()), "questions": []}
+    for question in questions:
+        if question.id not in matrix.columns:
+            continue
+        answered, shares = matrix.distribution(question.id, mask)
+        report["questions"].append({
+            "id": question.id,
+            "text": question.text,
+            "respondents": answered,
+            "choices": [{"id": choice_id, "text": texts[choice_id], "answers": counts[choice_id],
+                         "share": round(100 * share, 1)} for choice_id, share in shares.items()],
+        })
+    if row_question is not None and column_question is not None:
+        table = matrix.crosstab(row_question, column_question, mask)
+        row_choices = matrix.choices[matrix.columns[row_question]].tolist()
+        column_choices = matrix.choices[matrix.columns[column_question]].tolist()
+        report["crosstab"] = {
+            "columns": [texts[choice_id] for choice_id in column_choices],
+            "rows": [{"text": texts[choice_id], "counts": row}
+                     for choice_id, row in zip(row_choices, table.tolist())],
+        }
+    return report
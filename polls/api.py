@@ -0,0 +1,103 @@
+import json
+from functools import wraps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_GET, require_POST, condition
+from .models import Poll, Question, Choice, PollResult
+from .tree import get_poll_tree
+from .views import polls_queryset, submit_poll
+from .journal import flush_pending
+from .archive import collect_results
+
+
+def api_login_required(view):
+    """Для API вместо редиректа на страницу входа отдаем 401"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({"errors": ["Authentication required."]}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def poll_etag(request, poll_id):
+    """ETag определения опроса меняется вместе с версией опроса"""
+    version = Poll.objects.filter(pk=poll_id, visibility=True).values_list('version', flat=True).first()
+    return None if version is None else f'poll-{poll_id}-v{version}'
+
+
+@require_GET
+@api_login_required
+def polls_list(request):
+    done = request.GET.get('done')
+    polls = polls_queryset(request.user, False if done == "0" or done is None else True).order_by('id')
+    return JsonResponse({"polls": list(polls.values('id', 'name', 'description', 'version'))})
+
+
+@require_GET
+@api_login_required
+@condition(etag_func=poll_etag)
+def poll_definition(request, poll_id):
+    """Вопросы, варианты ответа и условия показа опроса"""
+    poll = get_object_or_404(Poll, pk=poll_id, visibility=True)
+    tree = {node.id: node for node in get_poll_tree(poll).questions}
+    questions = Question.objects.filter(poll=poll).prefetch_related(
+        Prefetch('choice_set', queryset=Choice.objects.order_by('id')))
+    response = JsonResponse({
+        "id": poll.id,
+        "name": poll.name,
+        "description": poll.description,
+        "version": poll.version,
+        "single_page": poll.single_page,
+        "questions": [{
+            "id": question.id,
+            "text": question.text,
+            "choice_type": question.choice_type,
+            "default": question.default,
+            "choices": [{"id": choice.id, "text": choice.text} for choice in question.choice_set.all()],
+            "show": sorted(tree[question.id].show) if question.id in tree else [],
+            "hide": sorted(tree[question.id].hide) if question.id in tree else [],
+        } for question in questions],
+    })
+    # Определение одинаково для всех пользователей: общий кэш может хранить его, но каждый раз сверяет ETag
+    # с приложением, а оно проверяет вход. Ответ зависит от сессии (401 без входа), отсюда Vary: Cookie
+    patch_cache_control(response, public=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+@require_POST
+@api_login_required
+def poll_answers(request, poll_id):
+    """
+    Ответы на весь опрос: {"answers": {"<question_id>": [choice_id, ...]}}. Проверяются по дереву опроса
+    так же, как ответы с одной страницы.
+    """
+    poll = get_object_or_404(Poll, pk=poll_id, visibility=True)
+    try:
+        answers = json.loads(request.body)["answers"]
+        submitted = {int(question_id): {int(choice_id) for choice_id in choices_ids}
+                     for question_id, choices_ids in answers.items()}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({"errors": ["Body must be {\"answers\": {question_id: [choice_id, ...]}}."]}, status=400)
+    try:
+        result = submit_poll(poll, request.user, submitted)
+    except ValidationError as e:
+        return JsonResponse({"errors": e.messages}, status=400)
+    return JsonResponse({"result": result.id}, status=201)
+
+
+@require_GET
+@api_login_required
+def poll_result(request, poll_id):
+    if settings.POLLS_ANSWER_JOURNAL:
+        flush_pending(poll_id, request.user.id)
+    result = get_object_or_404(PollResult.objects.select_related('poll'), poll_id=poll_id, user=request.user)
+    results = result.snapshot
+    if results is None:
+        results = collect_results(result)
+    return JsonResponse({"finished": result.finished, **results})
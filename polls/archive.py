@@ -0,0 +1,193 @@
+"""
+Архив ответов на закрытые опросы. Ответы опроса переносятся из таблицы Answer в файлы .npy
+в каталоге settings.POLLS_ARCHIVE_DIR, по файлу на колонку (result, user, question, choice), строки
+упорядочены по PollResult и порядку ответов. PollResult остаются в базе: по ним строятся список
+пройденных опросов и страница результатов. Архив читается через memory map, поэтому страница результатов
+и выгрузка не загружают весь опрос в память. Нужен numpy.
+"""
+import json
+import shutil
+from array import array
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Count, Sum, Prefetch
+from .models import Poll, Question, Choice, Answer
+from .journal import flush_answers
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ('result', 'user', 'question', 'choice')
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("Poll archives require numpy.")
+    return np
+
+
+def archive_path(poll_id):
+    return Path(settings.POLLS_ARCHIVE_DIR) / f'poll_{poll_id}'
+
+
+def _answers(poll):
+    return Answer.objects.filter(poll_result__poll=poll)
+
+
+def _checksums(poll):
+    """Число ответов опроса и суммы колонок по базе одним запросом"""
+    totals = _answers(poll).order_by().aggregate(
+        rows=Count('id'), result=Sum('poll_result_id'), user=Sum('poll_result__user_id'),
+        question=Sum('question_id'), choice=Sum('choice_id'))
+    return {name: value or 0 for name, value in totals.items()}
+
+
+def _compact(values):
+    """Колонка из буфера array('q') в самом узком целом типе, в который помещаются id"""
+    numpy = require_numpy()
+    column = numpy.frombuffer(values, dtype=numpy.int64)
+    if len(column) == 0 or column.max() <= numpy.iinfo(numpy.int32).max:
+        column = column.astype(numpy.int32)
+    return column
+
+
+def write_archive(poll, chunk_size=10000):
+    """
+    Записывает ответы опроса в новый временный каталог рядом с архивом и возвращает его путь.
+    На место архива каталог переносит archive_poll после проверки.
+    """
+    path = archive_path(poll.id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent))
+    try:
+        columns = {name: array('q') for name in COLUMNS}  # 8 байт на id вместо объекта int в списке
+        rows = _answers(poll).order_by('poll_result_id', 'id').values_list(
+            'poll_result_id', 'poll_result__user_id', 'question_id', 'choice_id')
+        for row in rows.iterator(chunk_size=chunk_size):
+            for name, value in zip(COLUMNS, row):
+                columns[name].append(value)
+        numpy, total = require_numpy(), len(columns['result'])
+        for name in COLUMNS:
+            numpy.save(tmp / f'{name}.npy', _compact(columns.pop(name)))
+        (tmp / 'meta.json').write_text(json.dumps({"poll": poll.id, "version": poll.version, "rows": total}))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return tmp
+
+
+def open_archive(poll_id, path=None):
+    """Колонки архива опроса {имя: массив только для чтения через memory map}"""
+    numpy = require_numpy()
+    path = archive_path(poll_id) if path is None else path
+    return {name: numpy.load(path / f'{name}.npy', mmap_mode='r') for name in COLUMNS}
+
+
+def verify_archive(poll, path=None):
+    """Сравнивает число строк и суммы колонок архива с ответами в базе"""
+    archive = open_archive(poll.id, path)
+    expected = _checksums(poll)
+    actual = {"rows": len(archive['result']),
+              **{name: int(archive[name].sum(dtype='int64')) for name in COLUMNS}}
+    if actual != expected:
+        raise ArchiveError(f"Archive of poll {poll.id} does not match answers: {actual} != {expected}.")
+
+
+def archive_poll(poll):
+    """
+    Переносит ответы закрытого опроса в архив. Архив пишется во временный каталог, а на место переносится
+    под блокировкой опроса в той же транзакции, в которой ответы после проверки удаляются из базы и опрос
+    помечается архивным. Поэтому одновременные запуски не затирают архив друг друга. Возвращает число
+    перенесенных ответов.
+    """
+    if poll.visibility:
+        raise ArchiveError(f"Poll {poll.id} is visible, close it before archiving.")
+    if poll.archived:
+        raise ArchiveError(f"Poll {poll.id} is already archived.")
+    if settings.POLLS_ANSWER_JOURNAL:
+        while flush_answers():  # Ответы из журнала тоже должны попасть в архив
+            pass
+    tmp = write_archive(poll)
+    path, placed = archive_path(poll.id), False
+    try:
+        with transaction.atomic():
+            poll = Poll.objects.select_for_update().get(pk=poll.pk)
+            if poll.archived:
+                raise ArchiveError(f"Poll {poll.id} is already archived.")
+            if poll.visibility:
+                raise ArchiveError(f"Poll {poll.id} became visible while archiving.")
+            verify_archive(poll, tmp)
+            shutil.rmtree(path, ignore_errors=True)  # Остался от прерванного запуска: опрос не архивный
+            tmp.rename(path)
+            placed = True
+            archived, _ = _answers(poll).delete()
+            Poll.objects.filter(pk=poll.pk).update(archived=True)
+    except BaseException:
+        shutil.rmtree(path if placed else tmp, ignore_errors=True)  # Только файлы этого запуска
+        raise
+    return archived
+
+
+def _result_rows(archive, result_id):
+    """Границы строк одного PollResult, строки архива упорядочены по result"""
+    start, stop = archive['result'].searchsorted([result_id, result_id + 1])
+    return slice(int(start), int(stop))
+
+
+def collect_archived_results(result):
+    """Результаты пользователя из архива в том же виде, что и PollResult.collect_results"""
+    archive = open_archive(result.poll_id)
+    rows = _result_rows(archive, result.id)
+    chosen = {int(choice_id) for choice_id in archive['choice'][rows]}
+    answered = {int(question_id) for question_id in archive['question'][rows]}
+    questions = Question.objects.filter(id__in=answered).prefetch_related(
+        Prefetch('choice_set', queryset=Choice.objects.order_by('id')))
+    return {"poll_name": result.poll.name, "questions": [{
+        "id": question.id,
+        "text": question.text,
+        "choice_type": question.choice_type,
+        "choices": [{"id": choice.id, "text": choice.text, "checked": choice.id in chosen}
+                    for choice in question.choice_set.all()],
+    } for question in questions]}
+
+
+def iter_archived_results(poll, chunk_size=2000):
+    """То же, что export.iter_results, но по архиву: usernames читаются пачками по chunk_size результатов"""
+    archive = open_archive(poll.id)
+    results, users = archive['result'], archive['user']
+    if len(results) == 0:
+        return
+    # Начала строк каждого PollResult
+    numpy = require_numpy()
+    starts = numpy.flatnonzero(numpy.diff(results, prepend=results[0] - 1)).tolist() + [len(results)]
+    for first in range(0, len(starts) - 1, chunk_size):
+        bounds = starts[first:first + chunk_size + 1]
+        usernames = dict(User.objects.filter(id__in={int(users[start]) for start in bounds[:-1]})
+                         .values_list('id', 'username'))
+        for start, stop in zip(bounds, bounds[1:]):
+            chosen = {}
+            for question_id, choice_id in zip(archive['question'][start:stop].tolist(),
+                                              archive['choice'][start:stop].tolist()):
+                chosen.setdefault(question_id, []).append(choice_id)
+            yield int(results[start]), usernames.get(int(users[start])), chosen
+
+
+def delete_archive(poll_id):
+    shutil.rmtree(archive_path(poll_id), ignore_errors=True)
+
+
+def collect_results(result):
+    """PollResult.collect_results, для архивного опроса - по архиву"""
+    if result.poll.archived:
+        return collect_archived_results(result)
+    return result.collect_results()
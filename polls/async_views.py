@@ -0,0 +1,159 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.views import View
+from .models import Poll, Question, Choice, PollResult
+from .fragments import question_fragment
+from .journal import append_answers, with_pending, settle, flush_pending
+from .archive import collect_results
+from .live import stream_counts
+from .views import (KeysetPage, keyset_params, page_urls, polls_queryset, find_next_question, save_answers, finish_poll,
+                    submitted_choices_ids, vote_page, question_progress)
+import logging
+
+logger = logging.getLogger("polls")
+
+
+def login_required(view):
+    """login_required для асинхронных views, пользователь загружается без блокировки event loop"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not (await request.auser()).is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+class PollsListView(View):
+    """
+    Асинхронный вариант views.PollsListView. Страница опросов выбирается срезом запроса,
+    количество опросов считается через acount(), либо страница выбирается по ключу.
+    """
+    paginate_by = 5
+
+    async def get(self, request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        done = request.GET.get('done')
+        done = False if done == "0" or done is None else True
+        queryset = (await sync_to_async(polls_queryset)(user, done)).order_by('id')
+        if settings.POLLS_LIST_PAGINATION == 'keyset':
+            after, before = keyset_params(request)
+            rows = [poll async for poll in KeysetPage.slice(queryset, self.paginate_by, after, before)]
+            paginator, page = None, KeysetPage(rows, self.paginate_by, after, before)
+        else:
+            paginator = Paginator(range(await queryset.acount()), self.paginate_by)
+            page = paginator.get_page(request.GET.get('page'))
+            bottom = (page.number - 1) * self.paginate_by
+            page.object_list = [poll async for poll in queryset[bottom:bottom + self.paginate_by]]
+        previous_url, next_url = page_urls(request, page)
+        context = {"paginator": paginator, "page_obj": page, "is_paginated": page.has_previous() or page.has_next(),
+                   "object_list": page.object_list, "done": done, "previous_url": previous_url,
+                   "next_url": next_url}
+        return render(request, "polls/poll_list.html", context)
+
+
+async def render_question(request, poll, question, progress=None):
+    """Рендерит вопрос, форма вопроса берется из кэша"""
+    context = {"poll": poll, "question": question, "progress": progress,
+               "fragment": await sync_to_async(question_fragment)(poll, question)}
+    return render(request, "polls/vote.html", context)
+
+
+@login_required
+async def vote(request, poll_id):
+    poll = await aget_object_or_404(Poll, pk=poll_id, visibility=True)
+    if poll.single_page:
+        return await sync_to_async(vote_page)(request, poll)
+    if request.method == 'GET':
+        prev_question_id = request.GET.get('question')
+        invalid = request.GET.get('invalid')
+        if prev_question_id is not None and invalid is not None:   # Предыдущий ответ был плохой, повторяем вопрос еще раз
+            current_question = await aget_object_or_404(Question, pk=int(prev_question_id), poll_id=poll_id)
+            logger.debug(f'Re-vote question_{prev_question_id}')
+            progress = None
+        else:
+            result = await PollResult.objects.filter(poll_id=poll_id, user=await request.auser()).afirst()
+            if settings.POLLS_ANSWER_JOURNAL:
+                result = await sync_to_async(with_pending)(poll, await request.auser(), result)
+            if result is not None and result.finished:  # Опрос уже пройден, показываем результат
+                logger.debug('Vote is already finished.')
+                return redirect(f"/polls/result/{poll_id}")
+            if prev_question_id is None and (result is None or result.current_question_id is None):
+                current_question = await Question.objects.filter(poll_id=poll_id, default=True).afirst()
+                if current_question is None:
+                    raise Http404('Poll has no first question.')
+                logger.debug(f'Show first question_{current_question.id}')
+            else:
+                if result is None:
+                    raise Http404('No poll result.')
+                # Без номера вопроса продолжаем прерванный опрос с последнего отвеченного вопроса
+                prev_question_id = result.current_question_id if prev_question_id is None else int(prev_question_id)
+                current_question = await sync_to_async(find_next_question)(poll, prev_question_id, result)
+                if current_question is None:  # Не нашли подходящего вопроса для показа, завершаем опрос, показываем результат
+                    logger.debug('Finish vote. No questions to show.')
+                    result = await sync_to_async(settle)(result)
+                    result.poll = poll  # Опрос уже загружен, collect_results не запрашивает его еще раз
+                    await sync_to_async(finish_poll)(result)
+                    return redirect(f"/polls/result/{poll_id}")
+            progress = await sync_to_async(question_progress)(poll, current_question, result)
+        return await render_question(request, poll, current_question, progress)
+    elif request.method == 'POST':
+        question_id = request.POST.get('question')
+        if question_id is None:
+            raise BadRequest("No question was provided.")
+        question_id = int(question_id)
+        question = await aget_object_or_404(Question, pk=question_id, poll_id=poll_id)
+        redirect_url = f"/polls/vote/{poll_id}?question={question_id}"
+        choices_ids = submitted_choices_ids(request.POST)
+        if len(choices_ids) == 0:   # Не переданы choices
+            messages.error(request, "No choices were selected. Please vote again")
+            logger.debug('No choices were selected.')
+            return redirect(redirect_url + "&invalid=1")
+        choices = [choice async for choice in Choice.objects.filter(id__in=choices_ids, question=question)]
+        if len(choices) != len(set(choices_ids)):    # Переданы плохие choices
+            logger.error('Not all choices from current question.')
+            return redirect(redirect_url + "&invalid=1")
+        if question.choice_type == 0 and len(choices) > 1:
+            logger.error('Multiple choices for question with single choice.')
+            return redirect(redirect_url + "&invalid=1")
+        if settings.POLLS_ANSWER_JOURNAL:
+            await sync_to_async(append_answers)(poll_id, (await request.auser()).id, question, choices_ids)
+        else:
+            await sync_to_async(save_answers)(poll_id, await request.auser(), question, choices)
+        return redirect(redirect_url)
+
+
+@login_required
+async def result_poll(request, poll_id):
+    if settings.POLLS_ANSWER_JOURNAL:
+        await sync_to_async(flush_pending)(poll_id, (await request.auser()).id)
+    result = await aget_object_or_404(PollResult.objects.select_related('poll'), poll_id=poll_id,
+                                      user=await request.auser())
+    results = result.snapshot
+    if results is None:
+        results = await sync_to_async(collect_results)(result)
+    context = {"poll_name": results["poll_name"], "questions": results["questions"]}
+    return render(request, "polls/poll_result.html", context)
+
+
+@login_required
+async def live_results(request, poll_id):
+    """Счетчики опроса для сотрудников в виде Server-Sent Events, обновляются по мере поступления ответов"""
+    if not (await request.auser()).is_staff:
+        raise PermissionDenied
+    if not isinstance(request, ASGIRequest):  # Под WSGI поток занял бы поток воркера до закрытия
+        raise Http404("Live results are served only under ASGI.")
+    poll = await aget_object_or_404(Poll, pk=poll_id)
+    response = StreamingHttpResponse(stream_counts(poll.id), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx не буферизует поток
+    return response
@@ -0,0 +1,85 @@
+"""
+Замеры основных путей опроса для pytest-benchmark на синтетических данных из polls.benchmark.
+Запуск: pytest polls/bench_vote.py --benchmark-json=benchmark.json
+Число запросов в базу попадает в extra_info отчета.
+"""
+from random import Random
+import pytest
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from polls.benchmark import generate_polls, vote_through, Timings
+from polls.models import Question, PollResult, Answer
+from polls.tree import get_poll_tree, _trees
+from polls.views import find_next_question, search_next_question
+
+QUESTIONS = 30
+CHOICES = 3
+CONDITION_DENSITY = 0.1
+
+
+@pytest.fixture
+def synthetic(db, client):
+    # id в тестовой базе повторяются между тестами, кэши от других тестов не подходят
+    caches[settings.POLLS_FRAGMENT_CACHE].clear()
+    _trees.clear()
+    polls, users = generate_polls(1, QUESTIONS, CHOICES, CONDITION_DENSITY, 1)
+    client.force_login(users[0])
+    return polls[0], users[0]
+
+
+@pytest.fixture
+def finished(synthetic, client):
+    """Опрос, пройденный пользователем, и путь по вопросам"""
+    poll, user = synthetic
+    path = vote_through(client, poll, Random(0), Timings())
+    return poll, PollResult.objects.get(poll=poll, user=user), path
+
+
+def run(benchmark, func, *args):
+    """Замеряет func и сохраняет число запросов одного вызова"""
+    with CaptureQueriesContext(connection) as queries:
+        func(*args)
+    benchmark.extra_info['queries'] = len(queries)
+    benchmark(func, *args)
+
+
+def test_list(benchmark, synthetic, client):
+    run(benchmark, client.get, reverse('polls:list'))
+
+
+def test_vote_first_question(benchmark, synthetic, client):
+    poll, _ = synthetic
+    run(benchmark, client.get, reverse('polls:vote', args=[poll.id]))
+
+
+def test_vote_cycle(benchmark, synthetic, client):
+    poll, user = synthetic
+    rnd = Random(0)
+    timings = Timings()
+
+    def reset():
+        PollResult.objects.filter(poll=poll, user=user).delete()
+        return (client, poll, rnd, timings), {}
+
+    benchmark.pedantic(vote_through, setup=reset, rounds=5)
+    benchmark.extra_info['paths'] = timings.report()
+
+
+def test_find_next_question(benchmark, finished):
+    poll, result, path = finished
+    get_poll_tree(poll)
+    run(benchmark, find_next_question, poll, path[0], result)
+
+
+def test_search_next_question(benchmark, finished):
+    poll, result, path = finished
+    run(benchmark, search_next_question, Question.objects.filter(poll=poll, pk__gt=path[0]),
+        Answer.objects.filter(poll_result=result))
+
+
+def test_result_poll(benchmark, finished, client):
+    poll, _, _ = finished
+    run(benchmark, client.get, reverse('polls:result', args=[poll.id]))
@@ -0,0 +1,154 @@
+import math
+import time
+from contextlib import contextmanager
+from random import Random
+from uuid import uuid4
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Poll, Question, Choice, Condition, PollResult, Answer
+from .tree import get_poll_tree
+from .views import find_next_question, search_next_question
+
+
+def generate_polls(polls_num, questions_num, choices_num, condition_density, users_num, seed=0):
+    """
+    Создает синтетические опросы и пользователей через bulk_create. Первый вопрос опроса показывается всегда,
+    условия вопроса ссылаются на choices предыдущих вопросов с вероятностью condition_density.
+    Возвращает (polls, users).
+    """
+    rnd = Random(seed)
+    tag = uuid4().hex[:8]
+    polls = Poll.objects.bulk_create(Poll(name=f'benchmark {tag} {i}', visibility=True) for i in range(polls_num))
+    questions = Question.objects.bulk_create(
+        Question(poll=poll, text=f'question {j}', default=j == 0 or rnd.random() < 0.5, choice_type=rnd.randint(0, 1))
+        for poll in polls for j in range(questions_num)
+    )
+    choices = Choice.objects.bulk_create(
+        Choice(question=question, text=f'choice {k}') for question in questions for k in range(choices_num)
+    )
+    conditions, earlier_choices = [], []
+    for i, question in enumerate(questions):
+        if i % questions_num == 0:  # Начался следующий опрос
+            earlier_choices = []
+        for choice in earlier_choices:
+            if rnd.random() < condition_density:
+                conditions.append(Condition(question=question, choice=choice, condition_type=rnd.random() < 0.5))
+        earlier_choices.extend(choices[i * choices_num:(i + 1) * choices_num])
+    Condition.objects.bulk_create(conditions, batch_size=1000)
+    password = make_password(None)
+    users = User.objects.bulk_create(User(username=f'benchmark_{tag}_{i}', password=password)
+                                     for i in range(users_num))
+    return polls, users
+
+
+def percentile(values, q):
+    """Перцентиль q по методу ближайшего ранга"""
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class Timings:
+    """Время выполнения и число запросов в базу по путям"""
+
+    def __init__(self):
+        self.paths = {}
+
+    @contextmanager
+    def measure(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            yield
+            elapsed = time.perf_counter() - start
+        self.paths.setdefault(path, []).append((elapsed, len(queries)))
+
+    def report(self):
+        report = {}
+        for path, runs in self.paths.items():
+            times = [elapsed * 1000 for elapsed, _ in runs]
+            queries = [queries_num for _, queries_num in runs]
+            report[path] = {
+                "runs": len(runs),
+                "p50_ms": round(percentile(times, 50), 3),
+                "p90_ms": round(percentile(times, 90), 3),
+                "p99_ms": round(percentile(times, 99), 3),
+                "max_ms": round(max(times), 3),
+                "queries_mean": round(sum(queries) / len(queries), 2),
+                "queries_max": max(queries),
+            }
+        return report
+
+
+def vote_through(client, poll, rnd, timings):
+    """
+    Проходит опрос как браузер: GET вопроса и POST ответа, пока вопросы не закончатся, затем GET,
+    который завершает опрос. Следующий вопрос для ответа выбирается по дереву опроса.
+    Возвращает id показанных вопросов.
+    """
+    tree = get_poll_tree(poll)
+    nodes = {node.id: node for node in tree.questions}
+    vote_url = reverse('polls:vote', args=[poll.id])
+    url, chosen, path = vote_url, set(), []
+    question_id = tree.next_question(0, chosen)
+    while question_id is not None:
+        with timings.measure('vote_get'):
+            client.get(url)
+        node = nodes[question_id]
+        answer = rnd.sample(sorted(node.choices), 1 if node.single else rnd.randint(1, len(node.choices)))
+        data = {"radio": answer[0]} if node.single else {f"checkbox_{choice_id}": choice_id for choice_id in answer}
+        with timings.measure('vote_post'):
+            client.post(vote_url, {"question": question_id, **data})
+        chosen.update(answer)
+        path.append(question_id)
+        url = f'{vote_url}?question={question_id}'
+        question_id = tree.next_question(question_id, chosen)
+    with timings.measure('vote_finish'):
+        client.get(url)
+    return path
+
+
+def search_through(poll, result, path, timings):
+    """Ищет следующий вопрос после каждого вопроса пройденного пути настроенным способом и исходным циклом"""
+    answers = Answer.objects.filter(poll_result=result)
+    for question_id in [0] + path:
+        with timings.measure('find_next_question'):
+            find_next_question(poll, question_id, result)
+        with timings.measure('search_next_question'):
+            search_next_question(Question.objects.filter(poll=poll, pk__gt=question_id), answers)
+
+
+def run_benchmark(polls_num, questions_num, choices_num, condition_density, users_num, seed=0, keep=False):
+    """
+    Создает синтетические данные, проходит все опросы каждым пользователем через тестовый клиент Django
+    и возвращает отчет для сравнения запусков. Без keep созданные данные удаляются.
+    """
+    rnd = Random(seed)
+    polls, users = generate_polls(polls_num, questions_num, choices_num, condition_density, users_num, seed)
+    timings = Timings()
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for user in users:
+                client = Client()
+                client.force_login(user)
+                for poll in polls:
+                    with timings.measure('list'):
+                        client.get(reverse('polls:list'))
+                    path = vote_through(client, poll, rnd, timings)
+                    with timings.measure('result_poll'):
+                        client.get(reverse('polls:result', args=[poll.id]))
+                    search_through(poll, PollResult.objects.get(poll=poll, user=user), path, timings)
+                client.logout()
+    finally:
+        if not keep:
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+            Poll.objects.filter(id__in=[poll.id for poll in polls]).delete()
+    return {
+        "parameters": {"polls": polls_num, "questions": questions_num, "choices": choices_num,
+                       "condition_density": condition_density, "users": users_num, "seed": seed},
+        "engine": settings.POLLS_NEXT_QUESTION_ENGINE,
+        "paths": timings.report(),
+    }
@@ -0,0 +1,39 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .models import PollResult
+
+# Запасной срок жизни списка на случай, если сброс версии не дошел до кэша
+COMPLETED_POLLS_TIMEOUT = 24 * 60 * 60
+
+
+def completed_polls_version_key(user_id):
+    return f'polls:completed:user_{user_id}:version'
+
+
+def completed_polls_key(user_id, version):
+    return f'polls:completed:user_{user_id}:v{version}'
+
+
+def completed_poll_ids(user):
+    """
+    id опросов, которые пользователь начал проходить. Список хранится под версией пользователя, которую
+    меняет создание PollResult: если список прочитан из базы до коммита нового PollResult, он запишется
+    под старой версией и больше не будет прочитан.
+    """
+    cache = caches[settings.POLLS_FRAGMENT_CACHE]
+    version_key = completed_polls_version_key(user.id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), None)
+        version = cache.get(version_key)
+    key = completed_polls_key(user.id, version)
+    poll_ids = cache.get(key)
+    if poll_ids is None:
+        poll_ids = list(PollResult.objects.filter(user=user).values_list('poll_id', flat=True))
+        cache.set(key, poll_ids, COMPLETED_POLLS_TIMEOUT)
+    return poll_ids
+
+
+def forget_completed_polls(user_id):
+    caches[settings.POLLS_FRAGMENT_CACHE].set(completed_polls_version_key(user_id), time.time_ns(), None)
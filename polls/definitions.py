@@ -0,0 +1,148 @@
+"""
+Описания опросов в JSON: опрос, вопросы по порядку, варианты ответа и условия показа. Условия ссылаются
+на вопросы и варианты ответа по их номерам в опросе, поэтому описание не зависит от id в базе.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from .models import Poll, Question, Choice, Condition
+
+BATCH_SIZE = 1000
+
+
+def export_definitions(polls):
+    """Описания опросов polls за четыре запроса"""
+    polls = list(polls.order_by('id'))
+    poll_ids = [poll.id for poll in polls]
+    questions = {}  # poll_id: [описания вопросов]
+    positions = {}  # question_id: (номер вопроса в опросе, описание вопроса)
+    for question_id, poll_id, text, default, choice_type in (
+            Question.objects.filter(poll__in=poll_ids).order_by('id')
+            .values_list('id', 'poll_id', 'text', 'default', 'choice_type')):
+        definition = {"text": text, "default": default, "choice_type": choice_type, "choices": [], "conditions": []}
+        poll_questions = questions.setdefault(poll_id, [])
+        positions[question_id] = (len(poll_questions), definition)
+        poll_questions.append(definition)
+    choices = {}  # choice_id: (номер вопроса, номер варианта ответа)
+    for choice_id, question_id, text in (Choice.objects.filter(question__poll__in=poll_ids).order_by('id')
+                                         .values_list('id', 'question_id', 'text')):
+        question_num, definition = positions[question_id]
+        choices[choice_id] = (question_num, len(definition["choices"]))
+        definition["choices"].append(text)
+    for question_id, choice_id, condition_type in (Condition.objects.filter(question__poll__in=poll_ids)
+                                                   .order_by('question_id', 'choice_id')
+                                                   .values_list('question_id', 'choice_id', 'condition_type')):
+        question_num, choice_num = choices[choice_id]
+        positions[question_id][1]["conditions"].append(
+            {"question": question_num, "choice": choice_num, "show": condition_type})
+    return {"polls": [
+        {"name": poll.name, "description": poll.description, "visibility": poll.visibility,
+         "single_page": poll.single_page, "questions": questions.get(poll.id, [])}
+        for poll in polls
+    ]}
+
+
+def validate_definitions(data):
+    """
+    Проверяет описания опросов целиком по правилам Poll.clean и Condition.clean, а также ограничениям полей.
+    Возвращает список всех ошибок.
+    """
+    errors = []
+    if not isinstance(data, dict) or not isinstance(data.get("polls"), list):
+        return ['Definitions must be an object with a list of polls.']
+    name_length = Poll._meta.get_field('name').max_length
+    text_length = Question._meta.get_field('text').max_length
+    choice_length = Choice._meta.get_field('text').max_length
+    for poll_num, poll in enumerate(data["polls"]):
+        where = f'Poll {poll_num}'
+        if not isinstance(poll, dict):
+            errors.append(f'{where}: poll must be an object.')
+            continue
+        name = poll.get("name")
+        if not isinstance(name, str) or not 0 < len(name) <= name_length:
+            errors.append(f'{where}: name must be a non-empty string of at most {name_length} characters.')
+        questions = poll.get("questions", [])
+        if not isinstance(questions, list):
+            errors.append(f'{where}: questions must be a list.')
+            continue
+        invalid = [str(num) for num, question in enumerate(questions) if not isinstance(question, dict)
+                   or not isinstance(question.get("choices", []), list)
+                   or not isinstance(question.get("conditions", []), list)]
+        if len(invalid) != 0:  # Дальше вопросы читаются как объекты, остальные правила проверяются после исправления
+            errors.append(f'{where}: each question must be an object with lists of choices and conditions. '
+                          f'Invalid questions: {", ".join(invalid)}.')
+            continue
+        if poll.get("visibility"):  # Правила Poll.clean для показываемого опроса
+            if len(questions) < 1:
+                errors.append(f'{where}: poll must have at least one question.')
+            elif not any(question.get("default") for question in questions):
+                errors.append(f'{where}: no first question in poll.')
+            invalid = [str(num) for num, question in enumerate(questions) if len(question.get("choices", [])) < 2]
+            if len(invalid) != 0:
+                errors.append(f'{where}: each question in poll must have at least two choices. '
+                              f'Invalid questions: {", ".join(invalid)}.')
+        for question_num, question in enumerate(questions):
+            where = f'Poll {poll_num}, question {question_num}'
+            text = question.get("text")
+            if not isinstance(text, str) or not 0 < len(text) <= text_length:
+                errors.append(f'{where}: text must be a non-empty string of at most {text_length} characters.')
+            choice_type = question.get("choice_type", 0)
+            if not isinstance(choice_type, int) or choice_type not in Question.TYPE:
+                errors.append(f'{where}: unknown choice_type {choice_type}.')
+            for choice in question.get("choices", []):
+                if not isinstance(choice, str) or not 0 < len(choice) <= choice_length:
+                    errors.append(f'{where}: choice text must be a non-empty string of at most {choice_length} '
+                                  f'characters.')
+            seen = set()
+            for condition in question.get("conditions", []):
+                target = (condition.get("question"), condition.get("choice")) if isinstance(condition, dict) else ()
+                if len(target) == 0 or not isinstance(target[0], int) or not isinstance(target[1], int):
+                    errors.append(f'{where}: condition must refer to a question and a choice by their numbers.')
+                elif target[0] >= question_num or target[0] < 0:  # Правило Condition.clean
+                    errors.append(f'{where}: wrong order of questions in condition on question {target[0]}.')
+                elif not 0 <= target[1] < len(questions[target[0]].get("choices", [])):
+                    errors.append(f'{where}: no choice {target[1]} in question {target[0]}.')
+                elif target in seen:
+                    errors.append(f'{where}: duplicate condition on choice {target[1]} of question {target[0]}.')
+                seen.add(target)
+    return errors
+
+
+def import_definitions(data):
+    """
+    Создает опросы по описаниям одной транзакцией: сначала проверяется все описание, затем все строки
+    каждой модели создаются через bulk_create, id связанных строк берутся из созданных объектов.
+    Возвращает созданные опросы.
+    """
+    errors = validate_definitions(data)
+    if len(errors) != 0:
+        raise ValidationError(errors)
+    with transaction.atomic():
+        polls = Poll.objects.bulk_create(
+            [Poll(name=poll["name"], description=poll.get("description"), visibility=poll.get("visibility", False),
+                  single_page=poll.get("single_page", False)) for poll in data["polls"]],
+            batch_size=BATCH_SIZE)
+        questions = Question.objects.bulk_create(
+            [Question(poll=poll, text=question["text"], default=question.get("default", False),
+                      choice_type=question.get("choice_type", 0))
+             for poll, definition in zip(polls, data["polls"]) for question in definition.get("questions", [])],
+            batch_size=BATCH_SIZE)
+        definitions = [question for poll in data["polls"] for question in poll.get("questions", [])]
+        choices = Choice.objects.bulk_create(
+            [Choice(question=question, text=text)
+             for question, definition in zip(questions, definitions) for text in definition.get("choices", [])],
+            batch_size=BATCH_SIZE)
+        conditions = []
+        question_start = choice_start = 0  # Номера первого вопроса опроса и первого варианта ответа вопросов
+        choice_starts = []
+        for definition in definitions:
+            choice_starts.append(choice_start)
+            choice_start += len(definition.get("choices", []))
+        for poll in data["polls"]:
+            for question_num, definition in enumerate(poll.get("questions", [])):
+                question = questions[question_start + question_num]
+                for condition in definition.get("conditions", []):
+                    choice = choices[choice_starts[question_start + condition["question"]] + condition["choice"]]
+                    conditions.append(Condition(question=question, choice=choice, condition_type=condition.get("show", False)))
+            question_start += len(poll.get("questions", []))
+        Condition.objects.bulk_create(conditions, batch_size=BATCH_SIZE)
+    return polls
@@ -0,0 +1,72 @@
+import csv
+import json
+import zlib
+from .models import Choice, Answer
+from .archive import iter_archived_results
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу отдает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def iter_results(poll, chunk_size=2000):
+    """
+    Проходит по ответам опроса одним запросом с серверным курсором и отдает (id результата, username,
+    {question_id: [choice_id, ...]}) сразу, как только ответы очередного PollResult закончились.
+    Ответы архивного опроса читаются из архива.
+    """
+    if poll.archived:
+        yield from iter_archived_results(poll, chunk_size)
+        return
+    answers = Answer.objects.filter(poll_result__poll=poll).order_by('poll_result_id', 'id').values_list(
+        'poll_result_id', 'poll_result__user__username', 'question_id', 'choice_id')
+    result_id, username, chosen = None, None, {}
+    for answer_result_id, answer_username, question_id, choice_id in answers.iterator(chunk_size=chunk_size):
+        if answer_result_id != result_id:
+            if result_id is not None:
+                yield result_id, username, chosen
+            result_id, username, chosen = answer_result_id, answer_username, {}
+        chosen.setdefault(question_id, []).append(choice_id)
+    if result_id is not None:
+        yield result_id, username, chosen
+
+
+def csv_lines(poll, results):
+    """Строка на PollResult, по колонке на каждый choice опроса"""
+    columns = list(Choice.objects.filter(question__poll=poll).order_by('question_id', 'id')
+                   .values_list('question_id', 'id'))
+    writer = csv.writer(Echo())
+    yield writer.writerow(['result', 'user'] + [f'q{question_id}_c{choice_id}' for question_id, choice_id in columns])
+    for result_id, username, chosen in results:
+        yield writer.writerow([result_id, username] + [
+            1 if choice_id in chosen.get(question_id, ()) else '' for question_id, choice_id in columns])
+
+
+def ndjson_lines(poll, results):
+    for result_id, username, chosen in results:
+        yield json.dumps({"result": result_id, "user": username, "answers": chosen}, ensure_ascii=False) + '\n'
+
+
+def gzip_chunks(chunks):
+    """Сжимает поток в формат gzip по мере поступления данных"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_poll(poll, export_format="csv", compress=False, chunk_size=2000):
+    """Поток байтов с ответами на опрос в формате export_format, память не растет с числом ответов"""
+    lines = csv_lines if export_format == "csv" else ndjson_lines
+    chunks = (line.encode() for line in lines(poll, iter_results(poll, chunk_size)))
+    return gzip_chunks(chunks) if compress else chunks
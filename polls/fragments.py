@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+def _key(poll, question, part):
+    """В ключ входит версия опроса, поэтому после изменения опроса старые записи просто не читаются"""
+    return f'polls:{poll.id}:v{poll.version}:question_{question.id}:{part}'
+
+
+def question_choices(poll, question):
+    """Варианты ответа на вопрос из кэша"""
+    cache = caches[settings.POLLS_FRAGMENT_CACHE]
+    key = _key(poll, question, 'choices')
+    choices = cache.get(key)
+    if choices is None:
+        choices = list(question.choice_set.order_by('id').values('id', 'text'))
+        cache.set(key, choices, None)
+    return choices
+
+
+def question_fragment(poll, question):
+    """Отрендеренная форма вопроса из кэша"""
+    cache = caches[settings.POLLS_FRAGMENT_CACHE]
+    key = _key(poll, question, 'form')
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = render_to_string("polls/question_fragment.html",
+                                    {"question": question, "choices": question_choices(poll, question)})
+        cache.set(key, fragment, None)
+    return mark_safe(fragment)
@@ -0,0 +1,235 @@
+"""
+Журнал ответов для режима отложенной записи (settings.POLLS_ANSWER_JOURNAL). Проверенные ответы на вопрос
+дописываются в локальную базу SQLite, а в основную базу переносятся пачками командой
+flush_answer_journal. Пока ответы в журнале, прохождение опроса пользователем учитывает их,
+а результаты опроса сначала переносят ответы пользователя из журнала.
+"""
+import json
+import sqlite3
+import time
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import Poll, Question, Choice, PollResult, Answer
+from .stats import count_batch
+from .completions import forget_completed_polls
+from .tree import get_poll_tree
+import logging
+
+logger = logging.getLogger("polls")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    poll_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    single INTEGER NOT NULL,
+    choice_ids TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_poll_user ON answers (poll_id, user_id);
+"""
+
+
+def _connect():
+    connection = sqlite3.connect(settings.POLLS_ANSWER_JOURNAL, timeout=30, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=FULL')  # Ответ записан на диск до ответа пользователю
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def append_answers(poll_id, user_id, question, choice_ids):
+    """Дописывает проверенные ответы на вопрос в журнал"""
+    connection = _connect()
+    try:
+        connection.execute(
+            'INSERT INTO answers (poll_id, user_id, question_id, single, choice_ids, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (poll_id, user_id, question.id, int(question.choice_type == 0), json.dumps(sorted(set(choice_ids))),
+             time.time()))
+    finally:
+        connection.close()
+
+
+def pending_answers(poll_id, user_id):
+    """Ответы пользователя на опрос из журнала по порядку: [(question_id, [choice_ids])]"""
+    if not settings.POLLS_ANSWER_JOURNAL:
+        return []
+    connection = _connect()
+    try:
+        rows = connection.execute('SELECT question_id, choice_ids FROM answers WHERE poll_id = ? AND user_id = ? '
+                                  'ORDER BY id', (poll_id, user_id)).fetchall()
+    finally:
+        connection.close()
+    return [(question_id, json.loads(choice_ids)) for question_id, choice_ids in rows]
+
+
+def with_pending(poll, user, result):
+    """
+    Прогресс опроса с учетом ответов из журнала. result - PollResult из базы или None. Если в журнале
+    есть ответы, возвращается PollResult (несохраненный, если его еще нет в базе) с их choices
+    в pending_choices. Ответы отбираются по тем же правилам, что и в apply_entries: повторный ответ
+    на вопрос с одним вариантом ответа не учитывается, потому что при переносе он будет отброшен.
+    """
+    pending = pending_answers(poll.id, user.id)
+    if len(pending) == 0:
+        return result
+    nodes = {node.id: node for node in get_poll_tree(poll).questions}
+    chosen = set(result.choices) if result is not None else set()
+    accepted, questions = [], []
+    for question_id, choice_ids in pending:
+        node = nodes.get(question_id)
+        new_choices = [choice_id for choice_id in choice_ids if choice_id not in chosen]
+        if node is None or len(new_choices) == 0 or (node.single and (not chosen.isdisjoint(node.choices)
+                                                                      or len(new_choices) > 1)):
+            continue
+        accepted.extend(new_choices)
+        chosen.update(new_choices)
+        questions.append(question_id)
+    if len(accepted) == 0:
+        return result
+    if result is None:
+        result = PollResult(poll=poll, user=user)
+    result.pending_choices = accepted
+    result.choices = result.choices + accepted
+    result.current_question_id = max(filter(None, [result.current_question_id, *questions]))
+    result.finished = False
+    return result
+
+
+def settle(result):
+    """Переносит ответы пользователя из журнала и возвращает PollResult из базы"""
+    if len(result.pending_choices) == 0:
+        return result
+    flush_answers(poll_id=result.poll_id, user_id=result.user_id)
+    return PollResult.objects.select_related('poll').get(poll_id=result.poll_id, user_id=result.user_id)
+
+
+def live_entries(entries):
+    """
+    Записи журнала, которые еще можно записать в базу. Ответы на архивные опросы отбрасываются: их ответы
+    читаются только из архива. Отбрасываются и записи, опрос, пользователь или вопрос которых удалены
+    после записи в журнал, а из ответа убираются удаленные choices: иначе вставка нарушит внешний ключ,
+    и перенос будет повторять одну и ту же пачку.
+    """
+    polls = dict(Poll.objects.filter(id__in={poll_id for poll_id, *_ in entries}).values_list('id', 'archived'))
+    users = set(User.objects.filter(id__in={user_id for _, user_id, *_ in entries}).values_list('id', flat=True))
+    questions = dict(Question.objects.filter(id__in={question_id for _, _, question_id, *_ in entries})
+                     .values_list('id', 'poll_id'))
+    choices = dict(Choice.objects.filter(id__in={choice_id for *_, choice_ids in entries for choice_id in choice_ids})
+                   .values_list('id', 'question_id'))
+    live, archived, deleted = [], Counter(), 0
+    for poll_id, user_id, question_id, single, choice_ids in entries:
+        if polls.get(poll_id):
+            archived[poll_id] += 1
+            continue
+        kept = [choice_id for choice_id in choice_ids if choices.get(choice_id) == question_id]
+        if poll_id not in polls or user_id not in users or questions.get(question_id) != poll_id or len(kept) == 0:
+            deleted += 1
+            continue
+        live.append((poll_id, user_id, question_id, single, kept))
+    if archived:
+        logger.warning(f'Dropped {archived.total()} journal entries of archived polls {sorted(archived)}')
+    if deleted:
+        logger.warning(f'Dropped {deleted} journal entries of deleted polls, users, questions or choices')
+    return live
+
+
+def apply_entries(entries):
+    """
+    Записывает ответы из журнала [(poll_id, user_id, question_id, single, choice_ids)] одной транзакцией
+    так же, как save_answers. Уже сохраненные ответы пропускаются, поэтому повторная запись безопасна.
+    Записи, которые нельзя записать (см. live_entries), отбрасываются.
+    """
+    entries = live_entries(entries)
+    pairs = {(poll_id, user_id) for poll_id, user_id, *_ in entries}
+    with transaction.atomic():
+        def load_results():
+            return {(result.poll_id, result.user_id): result for result in PollResult.objects.select_for_update()
+                    .filter(poll_id__in={poll_id for poll_id, _ in pairs}, user_id__in={user_id for _, user_id in pairs})
+                    if (result.poll_id, result.user_id) in pairs}
+        results = load_results()
+        missing = pairs - results.keys()
+        if missing:
+            PollResult.objects.bulk_create([PollResult(poll_id=poll_id, user_id=user_id) for poll_id, user_id in missing],
+                                           ignore_conflicts=True)
+            results = load_results()
+        answered = {}  # (poll_result_id, question_id): choice_ids
+        for result_id, question_id, choice_id in Answer.objects.filter(
+                poll_result__in=[result.id for result in results.values()],
+                question_id__in={question_id for _, _, question_id, *_ in entries}
+        ).values_list('poll_result_id', 'question_id', 'choice_id'):
+            answered.setdefault((result_id, question_id), set()).add(choice_id)
+        answers, touched = [], {}
+        poll_deltas, question_deltas, choice_deltas = {}, {}, {}
+        for poll_id, user_id, question_id, single, choice_ids in entries:
+            result = results[(poll_id, user_id)]
+            previous = answered.setdefault((result.id, question_id), set())
+            new_choices = [choice_id for choice_id in choice_ids if choice_id not in previous]
+            if len(new_choices) == 0 or (single and (len(previous) != 0 or len(new_choices) > 1)):
+                continue  # Ответ уже сохранен или повторный ответ на вопрос с одним вариантом ответа
+            poll_deltas.setdefault(poll_id, Counter()).update(respondents=int(len(result.choices) == 0),
+                                                               answers=len(new_choices))
+            moved = result.current_question_id is None or question_id > result.current_question_id
+            question_deltas.setdefault(question_id, Counter()).update(
+                respondents=int(len(previous) == 0), answers=len(new_choices), stopped=int(moved))
+            if moved and result.current_question_id is not None:
+                question_deltas.setdefault(result.current_question_id, Counter()).update(stopped=-1)
+            for choice_id in new_choices:
+                choice_deltas.setdefault(choice_id, Counter()).update(answers=1)
+                answers.append(Answer(poll_result=result, choice_id=choice_id, question_id=question_id,
+                                      single=bool(single)))
+            previous.update(new_choices)
+            if moved:
+                result.current_question_id = question_id
+            result.choices = result.choices + new_choices
+            result.finished = False
+            result.snapshot = None
+            touched[result.id] = result
+        Answer.objects.bulk_create(answers, batch_size=1000)
+        PollResult.objects.bulk_update(touched.values(), ['current_question', 'choices', 'finished', 'snapshot'],
+                                       batch_size=500)
+        count_batch(poll_deltas, question_deltas, choice_deltas)
+        for _, user_id in missing:
+            transaction.on_commit(lambda user_id=user_id: forget_completed_polls(user_id))
+    return len(answers)
+
+
+def flush_pending(poll_id, user_id):
+    """
+    Переносит ответы пользователя на опрос из журнала, только если они там есть: перенос блокирует журнал
+    на запись, а проверка только читает его
+    """
+    if len(pending_answers(poll_id, user_id)) != 0:
+        flush_answers(poll_id=poll_id, user_id=user_id)
+
+
+def flush_answers(batch_size=5000, poll_id=None, user_id=None):
+    """
+    Переносит до batch_size самых старых записей журнала (или записей одного пользователя) в основную базу.
+    Журнал заблокирован на запись до удаления перенесенных записей, поэтому переносы из разных процессов
+    не пересекаются. Возвращает число перенесенных записей.
+    """
+    connection = _connect()
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if poll_id is not None:
+                rows = connection.execute(
+                    'SELECT id, poll_id, user_id, question_id, single, choice_ids FROM answers '
+                    'WHERE poll_id = ? AND user_id = ? ORDER BY id', (poll_id, user_id)).fetchall()
+            else:
+                rows = connection.execute('SELECT id, poll_id, user_id, question_id, single, choice_ids FROM answers '
+                                          'ORDER BY id LIMIT ?', (batch_size,)).fetchall()
+            if rows:
+                apply_entries([(row[1], row[2], row[3], row[4], json.loads(row[5])) for row in rows])
+                connection.executemany('DELETE FROM answers WHERE id = ?', [(row[0],) for row in rows])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+    finally:
+        connection.close()
+    return len(rows)
@@ -0,0 +1,113 @@
+"""
+Поток счетчиков опроса для Server-Sent Events, работает только под ASGI. На каждый опрос, который кто-то
+смотрит, в процессе работает одна задача: раз в settings.POLLS_LIVE_INTERVAL секунд она читает PollCounter,
+а если число ответов изменилось, то и счетчики choices, и раздает их всем подписчикам опроса.
+Подписчик хранит только последнее сообщение, поэтому медленный клиент пропускает промежуточные
+состояния, а не копит очередь. Поток без новых ответов закрывается через POLLS_LIVE_IDLE_TIMEOUT секунд.
+"""
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import Choice, PollCounter
+import logging
+
+logger = logging.getLogger("polls")
+
+
+def read_counts(poll_id, answers=None):
+    """
+    Счетчики опроса {"respondents", "answers", "choices": {choice_id: answers}}. Если число ответов
+    не изменилось и равно answers, возвращает None после одного запроса.
+    """
+    respondents, total = PollCounter.objects.filter(poll_id=poll_id).values_list(
+        'respondents', 'answers').first() or (0, 0)
+    if total == answers:
+        return None
+    choices = Choice.objects.filter(question__poll_id=poll_id).order_by('id').values_list('id', 'counter__answers')
+    return {"respondents": respondents, "answers": total,
+            "choices": {choice_id: choice_answers or 0 for choice_id, choice_answers in choices}}
+
+
+class PollChannel:
+    """Подписчики одного опроса и задача, которая читает для них счетчики"""
+
+    def __init__(self, poll_id):
+        self.poll_id = poll_id
+        self.subscribers = set()
+        self.snapshot = None
+        self.task = None
+
+    async def subscribe(self, queue):
+        """Подписывает очередь и кладет в нее текущие счетчики"""
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        if self.snapshot is None:
+            self.snapshot = await sync_to_async(read_counts)(self.poll_id)
+        if queue.empty():
+            queue.put_nowait(self.snapshot)
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if len(self.subscribers) == 0:
+            if self.task is not None:
+                self.task.cancel()
+            if _channels.get(self.poll_id) is self:
+                del _channels[self.poll_id]
+
+    def publish(self, message):
+        self.snapshot = message
+        for queue in self.subscribers:
+            if queue.full():  # Клиент не успел забрать предыдущее сообщение, оно уже устарело
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.POLLS_LIVE_INTERVAL)
+            try:
+                answers = self.snapshot["answers"] if self.snapshot is not None else None
+                message = await sync_to_async(read_counts)(self.poll_id, answers)
+            except Exception:
+                logger.exception(f'Failed to read counters of poll_{self.poll_id}')
+                continue
+            if message is not None:
+                self.publish(message)
+
+
+_channels = {}
+
+
+def event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def stream_counts(poll_id):
+    """
+    События SSE со счетчиками опроса: сразу текущие счетчики, затем по событию на каждое изменение.
+    Раз в POLLS_LIVE_KEEPALIVE секунд без изменений отправляется комментарий, чтобы прокси не закрывал
+    соединение, а после POLLS_LIVE_IDLE_TIMEOUT секунд без изменений поток завершается событием idle.
+    """
+    channel = _channels.get(poll_id)
+    if channel is None:
+        channel = _channels[poll_id] = PollChannel(poll_id)
+    queue = asyncio.Queue(maxsize=1)
+    loop = asyncio.get_running_loop()
+    try:
+        await channel.subscribe(queue)
+        yield f'retry: {int(settings.POLLS_LIVE_INTERVAL * 1000)}\n'
+        updated = loop.time()
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), settings.POLLS_LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if loop.time() - updated >= settings.POLLS_LIVE_IDLE_TIMEOUT:
+                    yield event('idle', {})
+                    return
+                yield ': keepalive\n\n'
+                continue
+            updated = loop.time()
+            yield event('counts', message)
+    finally:
+        channel.unsubscribe(queue)
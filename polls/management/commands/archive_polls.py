@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from polls.models import Poll
+from polls.archive import ArchiveError, archive_poll
+
+
+class Command(BaseCommand):
+    help = ("Переносит ответы закрытых опросов из таблицы Answer в архив settings.POLLS_ARCHIVE_DIR "
+            "и удаляет их из базы после проверки архива.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int, help="id опросов")
+        parser.add_argument('--closed', action='store_true', help="Все закрытые опросы, которые еще не в архиве")
+
+    def handle(self, *args, **options):
+        if options['closed']:
+            polls = Poll.objects.filter(visibility=False, archived=False)
+        elif options['poll_ids']:
+            polls = Poll.objects.filter(id__in=options['poll_ids'])
+        else:
+            raise CommandError("Pass poll ids or --closed.")
+        for poll in polls.order_by('id'):
+            start = time.perf_counter()
+            try:
+                archived = archive_poll(poll)
+            except ArchiveError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f'Archived {archived} answers of poll_{poll.id} in {time.perf_counter() - start:.2f} s')
@@ -0,0 +1,31 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from polls.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Замеряет время и число запросов основных путей опроса на синтетических данных. "
+            "Отчет выводится в JSON. Данные создаются в настроенной базе и удаляются после замера.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--polls', type=int, default=1)
+        parser.add_argument('--questions', type=int, default=20, help="Вопросов в опросе")
+        parser.add_argument('--choices', type=int, default=3, help="Вариантов ответа на вопрос")
+        parser.add_argument('--condition-density', type=float, default=0.1,
+                            help="Вероятность условия от каждого choice предыдущих вопросов")
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Не удалять созданные данные")
+        parser.add_argument('--output', help="Файл для отчета, по умолчанию stdout")
+
+    def handle(self, *args, **options):
+        if min(options['polls'], options['questions'], options['choices'], options['users']) < 1:
+            raise CommandError("--polls, --questions, --choices and --users must be positive.")
+        report = run_benchmark(options['polls'], options['questions'], options['choices'],
+                               options['condition_density'], options['users'], options['seed'], options['keep'])
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,29 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from polls.models import Poll
+from polls.export import FORMATS, export_poll
+
+
+class Command(BaseCommand):
+    help = "Выгружает ответы на опрос построчно, по строке на PollResult."
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_id', type=int)
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help="Сжимать вывод в gzip")
+        parser.add_argument('--output', help="Файл для выгрузки, по умолчанию stdout")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            poll = Poll.objects.get(pk=options['poll_id'])
+        except Poll.DoesNotExist:
+            raise CommandError(f"Poll {options['poll_id']} does not exist.")
+        chunks = export_poll(poll, options['format'], options['gzip'], options['chunk_size'])
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
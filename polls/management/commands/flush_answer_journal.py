@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from polls.journal import flush_answers
+
+
+class Command(BaseCommand):
+    help = ("Переносит ответы из журнала отложенной записи (settings.POLLS_ANSWER_JOURNAL) в основную базу, "
+            "пока журнал не опустеет, с --loop работает постоянно.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--loop', action='store_true', help="Работать постоянно, как фоновый процесс")
+        parser.add_argument('--interval', type=float, default=1.0, help="Пауза в секундах, когда журнал пуст")
+
+    def handle(self, *args, **options):
+        if not settings.POLLS_ANSWER_JOURNAL:
+            raise CommandError("POLLS_ANSWER_JOURNAL is not set.")
+        while True:
+            start = time.perf_counter()
+            flushed = flush_answers(options['batch_size'])
+            if flushed:
+                self.stdout.write(f'Flushed {flushed} journal entries in {time.perf_counter() - start:.2f} s')
+            if flushed < options['batch_size']:  # Журнал пуст
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from polls.models import Poll
+from polls.analytics import poll_analytics
+
+
+class Command(BaseCommand):
+    help = ("Печатает в JSON распределения ответов на вопросы опроса в сегменте респондентов "
+            "и таблицу сопряженности двух вопросов.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_id', type=int)
+        parser.add_argument('--include', nargs='+', type=int, default=[],
+                            help="id choices, которые выбрали все респонденты сегмента")
+        parser.add_argument('--exclude', nargs='+', type=int, default=[],
+                            help="id choices, которые не выбрал ни один респондент сегмента")
+        parser.add_argument('--crosstab', nargs=2, type=int, metavar=('ROW_QUESTION', 'COLUMN_QUESTION'))
+
+    def handle(self, *args, **options):
+        try:
+            poll = Poll.objects.get(pk=options['poll_id'])
+        except Poll.DoesNotExist:
+            raise CommandError(f"Poll {options['poll_id']} does not exist.")
+        row, column = options['crosstab'] or (None, None)
+        try:
+            analytics = poll_analytics(poll, options['include'], options['exclude'], row, column)
+        except KeyError as e:
+            raise CommandError(f"Wrong analytics parameters: {e}")
+        self.stdout.write(json.dumps(analytics, ensure_ascii=False, indent=2))
@@ -0,0 +1,46 @@
+import json
+import sys
+import time
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from polls.models import Poll
+from polls.definitions import export_definitions, import_definitions
+
+
+class Command(BaseCommand):
+    help = "Выгружает и загружает описания опросов (вопросы, варианты ответа, условия показа) в JSON."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='action', required=True)
+        export_parser = subparsers.add_parser('export', help="Выгрузить описания опросов")
+        export_parser.add_argument('poll_ids', nargs='*', type=int, help="id опросов, по умолчанию все опросы")
+        export_parser.add_argument('--output', help="Файл для выгрузки, по умолчанию stdout")
+        import_parser = subparsers.add_parser('import', help="Создать опросы по описаниям")
+        import_parser.add_argument('input', help="Файл с описаниями, - для stdin")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'export':
+            polls = Poll.objects.all()
+            if options['poll_ids']:
+                polls = polls.filter(id__in=options['poll_ids'])
+            output = json.dumps(export_definitions(polls), ensure_ascii=False, indent=2)
+            if options['output']:
+                with open(options['output'], 'w') as f:
+                    f.write(output + '\n')
+            else:
+                self.stdout.write(output)
+            return
+        try:
+            if options['input'] == '-':
+                data = json.load(sys.stdin)
+            else:
+                with open(options['input']) as f:
+                    data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can't read definitions: {e}")
+        start = time.perf_counter()
+        try:
+            polls = import_definitions(data)
+        except ValidationError as e:
+            raise CommandError('Invalid definitions:\n' + '\n'.join(e.messages))
+        self.stdout.write(f'Imported {len(polls)} polls in {time.perf_counter() - start:.1f} s')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls.provisioning import iter_users, provision_users
+
+
+class Command(BaseCommand):
+    help = ("Создает пользователей из JSON-файла вида utils/users.json. Пароли хешируются в нескольких процессах, "
+            "уже существующие username пропускаются, поэтому команду можно запускать повторно.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Файл с пользователями")
+        parser.add_argument('--key', default='data', help="Ключ списка пользователей, пустой - файл сам список")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, help="Процессов для хеширования паролей, по умолчанию по числу ядер")
+
+    def progress(self, processed, created, seconds):
+        self.stdout.write(f'Processed {processed} users, created {created}, {processed / seconds:.0f} users/s')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['input']) as f:
+                processed, created = provision_users(iter_users(f, options['key'] or None), options['batch_size'],
+                                                     options['workers'], self.progress)
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Can't provision users: {e!r}")
+        self.stdout.write(f'Done: {processed} users, {created} created, {processed - created} skipped')
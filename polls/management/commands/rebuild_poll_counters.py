@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from polls.models import Poll
+from polls.stats import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счетчики статистики опросов по таблице Answer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int, help="id опросов, по умолчанию все опросы")
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.all()
+        if options['poll_ids']:
+            polls = polls.filter(id__in=options['poll_ids'])
+        for poll in polls:
+            if poll.archived:  # Ответов в базе уже нет, счетчики остаются такими, какими были при архивации
+                self.stdout.write(f'Skipped archived poll_{poll.id}')
+                continue
+            rebuild_counters(poll)
+            self.stdout.write(f'Rebuilt counters of poll_{poll.id}')
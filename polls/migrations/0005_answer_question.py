@@ -0,0 +1,51 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Subquery
+
+
+def fill_answer_questions(apps, schema_editor):
+    model_answer = apps.get_model('polls', 'Answer')
+    model_choice = apps.get_model('polls', 'Choice')
+    model_answer.objects.update(
+        question_id=Subquery(model_choice.objects.filter(pk=OuterRef('choice_id')).values('question_id')))
+    model_answer.objects.filter(question__choice_type=0).update(single=True)
+    # Гонка в старой проверке Answer.clean могла оставить несколько ответов на вопрос с одним вариантом,
+    # оставляем самый первый
+    duplicates = model_answer.objects.filter(single=True, poll_result=OuterRef('poll_result'),
+                                             question=OuterRef('question'), id__lt=OuterRef('id'))
+    model_answer.objects.filter(Exists(duplicates), single=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_poll_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='question',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='polls.question'),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='single',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_answer_questions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='question',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE,
+                                    to='polls.question'),
+        ),
+        migrations.AddConstraint(
+            model_name='answer',
+            constraint=models.UniqueConstraint(condition=models.Q(('single', True)),
+                                               fields=('poll_result', 'question'), name='unique_single_answer'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_answer_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollresult',
+            name='snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
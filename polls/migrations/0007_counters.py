@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_pollresult_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChoiceCounter',
+            fields=[
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='polls.choice')),
+                ('answers', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PollCounter',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='polls.poll')),
+                ('respondents', models.IntegerField(default=0)),
+                ('answers', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionCounter',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='polls.question')),
+                ('respondents', models.IntegerField(default=0)),
+                ('answers', models.IntegerField(default=0)),
+                ('stopped', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
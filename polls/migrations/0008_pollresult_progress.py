@@ -0,0 +1,45 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_progress(apps, schema_editor):
+    model_result = apps.get_model('polls', 'PollResult')
+    model_answer = apps.get_model('polls', 'Answer')
+    answers = model_answer.objects.order_by('poll_result_id', 'id').values_list('poll_result_id', 'question_id',
+                                                                               'choice_id')
+    progress = {}
+    for result_id, question_id, choice_id in answers.iterator(chunk_size=2000):
+        current_question_id, choices = progress.setdefault(result_id, [question_id, []])
+        progress[result_id][0] = max(current_question_id, question_id)
+        choices.append(choice_id)
+    results = [model_result(id=result_id, current_question_id=current_question_id, choices=choices)
+               for result_id, (current_question_id, choices) in progress.items()]
+    model_result.objects.bulk_update(results, ['current_question', 'choices'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollresult',
+            name='choices',
+            field=models.JSONField(default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name='pollresult',
+            name='current_question',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='polls.question'),
+        ),
+        migrations.AddField(
+            model_name='pollresult',
+            name='finished',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(fill_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_pollresult_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='single_page',
+            field=models.BooleanField(default=False),
+        ),
+    ]
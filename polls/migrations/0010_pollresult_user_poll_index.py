@@ -0,0 +1,19 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_poll_single_page'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pollresult',
+            index=models.Index(fields=['user', 'poll'], name='pollresult_user_poll'),
+        ),
+    ]
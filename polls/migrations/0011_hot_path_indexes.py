@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_pollresult_user_poll_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['poll_result', 'question'], name='answer_result_question'),
+        ),
+        migrations.AddIndex(
+            model_name='condition',
+            index=models.Index(fields=['question', 'choice'], name='condition_question_choice'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['poll', 'default', 'id'], name='question_poll_default'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['poll', 'id'], name='question_poll_id'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='archived',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -15,28 +15,68 @@ class Poll(models.Model):
     name = models.CharField(max_length=50)
     description = models.TextField(blank=True, null=True)
     visibility = models.BooleanField(default=False, choices=SHOW)
+    single_page = models.BooleanField(default=False)  # Весь опрос на одной странице, ветвление в браузере
+    version = models.PositiveIntegerField(default=0, editable=False)  # Растет при каждом изменении вопросов опроса
+    archived = models.BooleanField(default=False, editable=False)  # Ответы перенесены в архив (polls/archive.py)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        self.version = models.F('version') + 1  # Версию увеличивает база, чтобы не затереть версию из другого процесса
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+    @staticmethod
+    def bump_version(**filters):
+        """Увеличивает версию опросов, чтобы сбросить построенные по ним кэши"""
+        Poll.objects.filter(**filters).update(version=models.F('version') + 1)
+
+    @staticmethod
+    def validate_polls(polls):
+        """
+        Проверяет, можно ли показывать опросы пользователям, за два запроса для любого числа опросов.
+        Возвращает {poll_id: [ошибки]} для опросов с ошибками.
+        """
+        polls = {poll.id: poll for poll in polls}
+        questions = Question.objects.filter(poll__in=[poll_id for poll_id in polls if poll_id is not None])
+        counts = {
+            poll_id: (questions_num, defaults_num) for poll_id, questions_num, defaults_num in
+            questions.order_by().values('poll').annotate(questions_num=models.Count('id'),
+                                                         defaults_num=models.Count('id', filter=models.Q(default=True)))
+            .values_list('poll', 'questions_num', 'defaults_num')
+        }
+        invalid_questions = {}
+        for poll_id, question_id in (questions.order_by('id').annotate(choices_num=models.Count('choice'))
+                                     .filter(choices_num__lt=2).values_list('poll_id', 'id')):
+            invalid_questions.setdefault(poll_id, []).append(str(question_id))
+        errors = {}
+        for poll_id, poll in polls.items():
+            questions_num, defaults_num = counts.get(poll_id, (0, 0))
+            poll_errors = []
+            if poll.archived:
+                poll_errors.append(f'Poll {poll} is archived and can not be shown again.')
+            if questions_num < 1:
+                poll_errors.append(f'Poll must have at least one question. Poll: {poll}.')
+            elif defaults_num == 0:
+                poll_errors.append(f'No first question in poll {poll}')
+            if poll_id in invalid_questions:
+                poll_errors.append(f"Each question in poll must have at least two choices. Poll: {poll}. "
+                                   f"Invalid_questions: {', '.join(invalid_questions[poll_id])}")
+            if poll_errors:
+                errors[poll_id] = poll_errors
+        return errors
+
     def clean(self):
         if not self.visibility:  # Не позволяем показывать опрос у пользователя, если там ноль вопросов или вопрос с одним вариантом ответа
             return
-        questions = Question.objects.filter(poll=self)
-        if questions.count() < 1:
-            raise ValidationError(f'Poll must have at least one question. Poll: {self.__str__()}.')
-        inv_questions = []
-        first_question = None
-        for question in questions:
-            if question.default:
-                first_question = True
-            if not question.check_choices:
-                inv_questions.append(question.id)
-        if not first_question:
-            raise ValidationError(f'No first question in poll {self.__str__()}')
-        if len(inv_questions) != 0:
-            raise ValidationError(
-                f"Each question in poll must have at least two choices. Poll: {self.__str__()}. Invalid_questions: {', '.join(inv_questions)}")
+        errors = Poll.validate_polls([self])
+        if errors:
+            raise ValidationError(errors[self.id])
 
 
 class Question(models.Model):
@@ -60,6 +100,10 @@ class Question(models.Model):
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            models.Index(fields=['poll', 'default', 'id'], name='question_poll_default'),
+            models.Index(fields=['poll', 'id'], name='question_poll_id'),
+        ]
 
     def __str__(self):
         return self.text
@@ -109,6 +153,9 @@ class Condition(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['choice', 'question'], name='unique_condition')
         ]
+        indexes = [
+            models.Index(fields=['question', 'choice'], name='condition_question_choice'),
+        ]
 
     def clean(self):
         if self.question.poll != self.choice.question.poll:
@@ -123,12 +170,22 @@ class PollResult(models.Model):
     """
     poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    snapshot = models.JSONField(blank=True, null=True, editable=False)  # Результаты, сохраненные по завершении опроса
+    # Прогресс прохождения опроса: последний отвеченный вопрос, завершен ли опрос и id всех выбранных choices
+    current_question = models.ForeignKey(Question, on_delete=models.SET_NULL, blank=True, null=True,
+                                         editable=False, related_name='+')
+    finished = models.BooleanField(default=False, editable=False)
+    choices = models.JSONField(default=list, editable=False)
+    pending_choices = ()  # choices из журнала ответов (polls.journal), еще не перенесенные в базу
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['poll', 'user'], name='unique_result')
 
         ]
+        indexes = [
+            models.Index(fields=['user', 'poll'], name='pollresult_user_poll'),
+        ]
 
     @property
     def ansvered_questions(self):
@@ -137,20 +194,83 @@ class PollResult(models.Model):
         questions = answeres.values_list('choice__question_id', flat=True)
         return Question.objects.filter(id__in=questions)
 
+    def collect_results(self):
+        """Собирает вопросы, на которые ответили, с вариантами ответов и выбранными choices за три запроса"""
+        questions = self.ansvered_questions.prefetch_related(
+            models.Prefetch('choice_set', queryset=Choice.objects.order_by('id')),
+            models.Prefetch('answer_set', queryset=Answer.objects.filter(poll_result=self), to_attr='user_answers'),
+        )
+        results = []
+        for question in questions:
+            chosen = {answer.choice_id for answer in question.user_answers}
+            results.append({
+                "id": question.id,
+                "text": question.text,
+                "choice_type": question.choice_type,
+                "choices": [{"id": choice.id, "text": choice.text, "checked": choice.id in chosen}
+                            for choice in question.choice_set.all()],
+            })
+        return {"poll_name": self.poll.name, "questions": results}
+
 
 class Answer(models.Model):
     """
-    Модель описания ответа пользователя на вопрос.
+    Модель описания ответа пользователя на вопрос. question и single повторяют данные choice, чтобы
+    база данных сама не давала ответить дважды на вопрос с одним вариантом ответа.
     """
     poll_result = models.ForeignKey(PollResult, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, editable=False)
+    single = models.BooleanField(default=False, editable=False)  # Ответ на вопрос с одним вариантом ответа
 
     class Meta:
         ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['poll_result', 'question'], condition=models.Q(single=True),
+                                    name='unique_single_answer')
+        ]
+        indexes = [
+            models.Index(fields=['poll_result', 'question'], name='answer_result_question'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.question_id is None:
+            self.question = self.choice.question
+            self.single = self.question.choice_type == 0
+        super().save(*args, **kwargs)
 
     def clean(self):
-        if self.choice.question not in self.poll_result.poll.question_set.all():
+        if self.choice.question.poll_id != self.poll_result.poll_id:
             raise ValidationError('Question is not in this poll.')
         if self.choice.question.choice_type == 0:
-            if Answer.objects.filter(poll_result=self.poll_result, choice__question=self.choice.question).exists():
+            if Answer.objects.filter(poll_result=self.poll_result, question=self.choice.question).exists():
                 raise ValidationError('Question with single choice already have answer.')
+
+
+class PollCounter(models.Model):
+    """
+    Счетчики опроса: сколько пользователей начали опрос и сколько всего выбрано choices.
+    Обновляются в той же транзакции, что и Answer, пересчитываются командой rebuild_poll_counters.
+    """
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, primary_key=True, related_name='counter')
+    respondents = models.IntegerField(default=0)
+    answers = models.IntegerField(default=0)
+
+
+class QuestionCounter(models.Model):
+    """
+    Счетчики вопроса. respondents - сколько пользователей ответили на вопрос (охват),
+    stopped - для скольких пользователей вопрос последний отвеченный (отток или завершение опроса).
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='counter')
+    respondents = models.IntegerField(default=0)
+    answers = models.IntegerField(default=0)
+    stopped = models.IntegerField(default=0)
+
+
+class ChoiceCounter(models.Model):
+    """
+    Счетчик выборов варианта ответа.
+    """
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, primary_key=True, related_name='counter')
+    answers = models.IntegerField(default=0)
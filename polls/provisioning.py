@@ -0,0 +1,125 @@
+"""
+Массовое создание пользователей из файлов вида utils/users.json. Файл читается потоком, пароли хешируются
+в пуле процессов (PBKDF2 занимает почти все время), пользователи создаются пачками через bulk_create.
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+READ_SIZE = 64 * 1024
+
+
+def iter_users(file, key='data'):
+    """
+    Перебирает объекты из списка key JSON-файла {"key": [{...}, ...]}, не загружая файл целиком.
+    Без key файл должен быть самим списком.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = file.read(READ_SIZE)
+        eof = chunk == ''
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip(characters):
+        """Пропускает пробелы и characters, возвращает следующий символ или '' в конце файла"""
+        nonlocal position
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] in characters):
+                position += 1
+            if position < len(buffer) or eof:
+                return buffer[position:position + 1]
+            fill()
+
+    fill()
+    if key is not None:
+        marker = f'"{key}"'
+        while True:
+            index = buffer.find(marker, position)
+            if index == -1:
+                if eof:
+                    raise ValueError(f'No "{key}" list in file.')
+                position = max(position, len(buffer) - len(marker))  # Ключ может оказаться на стыке чтений
+                fill()
+                continue
+            position = index + len(marker)
+            if skip('') == ':':
+                break
+        position += 1
+        if skip('') != '[':
+            raise ValueError(f'"{key}" must be a list.')
+    elif skip('') != '[':
+        raise ValueError('File must contain a list.')
+    position += 1
+    while (character := skip(',')) != ']':
+        if character == '':
+            raise ValueError('Unexpected end of file.')
+        while True:
+            try:
+                user, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buffer) and not eof:  # Число или строка могли оборваться на границе чтения
+                fill()
+                continue
+            break
+        position = end
+        yield user
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def provision_users(users, batch_size=1000, workers=None, progress=None):
+    """
+    Создает пользователей users (словари с username, password, first_name, last_name, email), пропуская
+    уже существующие username. progress(processed, created, seconds) вызывается после каждой пачки.
+    Возвращает (processed, created).
+    """
+    processed = created = 0
+    workers = workers or os.cpu_count()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+        for batch in batches(users, batch_size):
+            processed += len(batch)
+            existing = set(User.objects.filter(username__in=[user['username'] for user in batch])
+                           .values_list('username', flat=True))
+            new_users = {}
+            for user in batch:
+                if user['username'] not in existing:
+                    new_users.setdefault(user['username'], user)
+            chunksize = max(1, len(new_users) // (4 * workers))
+            passwords = executor.map(make_password, [user['password'] for user in new_users.values()],
+                                     chunksize=chunksize)
+            now = timezone.now()
+            User.objects.bulk_create(
+                [User(username=user['username'], password=password, first_name=user.get('first_name', ''),
+                      last_name=user.get('last_name', ''), email=user.get('email', ''), is_active=True,
+                      last_login=now)
+                 for user, password in zip(new_users.values(), passwords)],
+                ignore_conflicts=True)
+            # bulk_create с ignore_conflicts возвращает все переданные объекты, вставленные строки
+            # отличаются от созданных другим процессом по last_login этой пачки
+            created += User.objects.filter(username__in=list(new_users), last_login=now).count()
+            if progress is not None:
+                progress(processed, created, time.perf_counter() - start)
+    return processed, created
@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .completions import forget_completed_polls
+from .models import Poll, Question, Choice, Condition, PollResult
+from .tree import forget_poll_tree
+from .archive import delete_archive
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    Poll.bump_version(pk=instance.poll_id)
+
+
+@receiver([post_save, post_delete], sender=Choice)
+@receiver([post_save, post_delete], sender=Condition)
+def question_part_changed(sender, instance, **kwargs):
+    Poll.bump_version(question__id=instance.question_id)
+
+
+@receiver(post_delete, sender=Poll)
+def poll_deleted(sender, instance, **kwargs):
+    forget_poll_tree(instance.id)
+    if instance.archived:
+        transaction.on_commit(lambda: delete_archive(instance.id))
+
+
+@receiver(post_save, sender=PollResult)
+@receiver(post_delete, sender=PollResult)
+def poll_result_changed(sender, instance, created=True, **kwargs):
+    if created:  # Сбрасываем после коммита, иначе другой запрос может закэшировать список без нового результата
+        transaction.on_commit(lambda: forget_completed_polls(instance.user_id))
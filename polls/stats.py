@@ -0,0 +1,113 @@
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, Max
+from .models import Question, Choice, PollResult, Answer, PollCounter, QuestionCounter, ChoiceCounter
+
+
+def _add(model, pks, **deltas):
+    """Прибавляет deltas к счетчикам с первичными ключами pks, создавая недостающие строки"""
+    values = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    if len(values) == 0 or len(pks) == 0:
+        return
+    if model.objects.filter(pk__in=pks).update(**values) < len(pks):
+        missing = set(pks) - set(model.objects.filter(pk__in=pks).values_list('pk', flat=True))
+        model.objects.bulk_create([model(pk=pk) for pk in missing], ignore_conflicts=True)
+        model.objects.filter(pk__in=missing).update(**values)
+
+
+def count_answers(poll_id, question_id, choice_ids, new_result, new_question, last_question_id):
+    """
+    Обновляет счетчики после сохранения ответов на вопрос. Должна вызываться в транзакции, которая сохраняет Answer.
+    last_question_id - последний вопрос, на который пользователь отвечал до этого.
+    """
+    _add(PollCounter, [poll_id], respondents=int(new_result), answers=len(choice_ids))
+    moved = last_question_id is None or question_id > last_question_id
+    _add(QuestionCounter, [question_id], respondents=int(new_question), answers=len(choice_ids), stopped=int(moved))
+    if moved and last_question_id is not None:
+        _add(QuestionCounter, [last_question_id], stopped=-1)
+    _add(ChoiceCounter, choice_ids, answers=1)
+
+
+def count_poll_answers(poll_id, path):
+    """
+    Обновляет счетчики после сохранения всего опроса разом. path - список (question_id, choice_ids)
+    отвеченных вопросов по порядку.
+    """
+    _add(PollCounter, [poll_id], respondents=1, answers=sum(len(choice_ids) for _, choice_ids in path))
+    by_answers_num = {}
+    for question_id, choice_ids in path:
+        by_answers_num.setdefault(len(choice_ids), []).append(question_id)
+    for answers_num, question_ids in by_answers_num.items():
+        _add(QuestionCounter, question_ids, respondents=1, answers=answers_num)
+    _add(QuestionCounter, [path[-1][0]], stopped=1)
+    _add(ChoiceCounter, [choice_id for _, choice_ids in path for choice_id in choice_ids], answers=1)
+
+
+def count_batch(polls, questions, choices):
+    """
+    Обновляет счетчики по накопленным изменениям {pk: Counter(поле=изменение)} для опросов, вопросов и
+    вариантов ответа. Счетчики с одинаковыми изменениями обновляются одним запросом.
+    """
+    for model, deltas in ((PollCounter, polls), (QuestionCounter, questions), (ChoiceCounter, choices)):
+        groups = {}
+        for pk, delta in deltas.items():
+            groups.setdefault(tuple(sorted(delta.items())), []).append(pk)
+        for delta, pks in groups.items():
+            _add(model, pks, **dict(delta))
+
+
+@transaction.atomic
+def rebuild_counters(poll):
+    """Пересчитывает счетчики опроса по таблице Answer"""
+    answers = Answer.objects.filter(poll_result__poll=poll).order_by()
+    choices = dict(answers.values('choice').annotate(answers=Count('id')).values_list('choice', 'answers'))
+    questions = {
+        question_id: (respondents, answers_num) for question_id, respondents, answers_num in
+        answers.values('question').annotate(respondents=Count('poll_result', distinct=True), answers=Count('id'))
+        .values_list('question', 'respondents', 'answers')
+    }
+    stopped = Counter(answers.values('poll_result').annotate(last=Max('question'))
+                      .values_list('last', flat=True).iterator())
+
+    PollCounter.objects.filter(poll=poll).delete()
+    QuestionCounter.objects.filter(question__poll=poll).delete()
+    ChoiceCounter.objects.filter(choice__question__poll=poll).delete()
+    PollCounter.objects.create(poll=poll, respondents=PollResult.objects.filter(poll=poll).count(),
+                               answers=sum(choices.values()))
+    QuestionCounter.objects.bulk_create(
+        QuestionCounter(question_id=question_id, respondents=questions.get(question_id, (0, 0))[0],
+                        answers=questions.get(question_id, (0, 0))[1], stopped=stopped[question_id])
+        for question_id in Question.objects.filter(poll=poll).values_list('id', flat=True)
+    )
+    ChoiceCounter.objects.bulk_create(
+        ChoiceCounter(choice_id=choice_id, answers=choices.get(choice_id, 0))
+        for choice_id in Choice.objects.filter(question__poll=poll).values_list('id', flat=True)
+    )
+
+
+def poll_statistics(poll):
+    """Статистика опроса только по счетчикам, без обращения к таблице Answer"""
+    counter = PollCounter.objects.filter(poll=poll).first()
+    respondents = counter.respondents if counter is not None else 0
+    choices = {}
+    for choice in Choice.objects.filter(question__poll=poll).select_related('counter').order_by('id'):
+        choices.setdefault(choice.question_id, []).append({
+            "id": choice.id,
+            "text": choice.text,
+            "answers": getattr(choice, 'counter', ChoiceCounter()).answers,
+        })
+    questions = []
+    for question in Question.objects.filter(poll=poll).select_related('counter'):
+        question_counter = getattr(question, 'counter', QuestionCounter())
+        for choice in choices.get(question.id, []):
+            choice["share"] = round(100 * choice["answers"] / question_counter.answers, 1) \
+                if question_counter.answers else 0
+        questions.append({
+            "text": question.text,
+            "respondents": question_counter.respondents,
+            "reach": round(100 * question_counter.respondents / respondents, 1) if respondents else 0,
+            "stopped": question_counter.stopped,
+            "choices": choices.get(question.id, []),
+        })
+    return {"respondents": respondents, "answers": counter.answers if counter is not None else 0,
+            "questions": questions}
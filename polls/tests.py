@@ -1,3 +1,1170 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from random import Random
+from unittest import skipUnless
+from unittest.mock import Mock, patch
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.contrib.auth import views as auth_views
+from django.urls import include, path, reverse
+from nomia.metrics import RequestStats, SLOW_SQL_LIMIT
+from .models import *
+from . import analytics, archive, async_views, fragments, live
+from .completions import completed_poll_ids
+from .definitions import export_definitions, import_definitions
+from .export import export_poll
+from .journal import pending_answers, append_answers, flush_answers, apply_entries
+from .provisioning import iter_users, provision_users
+from .stats import rebuild_counters, poll_statistics
+from .tree import get_poll_tree, _trees
+from .views import search_next_question, search_next_question_sql, find_next_question, save_answers
 
-# Create your tests here.
+
+def create_poll(name, questions_num, choices_num=2, rnd=None, condition_density=0.0):
+    """Создает опрос. Для каждого вопроса с вероятностью condition_density добавляются условия от choices
+    предыдущих вопросов"""
+    poll = Poll.objects.create(name=name, visibility=True)
+    created = []
+    for i in range(questions_num):
+        question = Question.objects.create(
+            poll=poll, text=f'{name} question {i}',
+            default=True if rnd is None or i == 0 else rnd.random() < 0.5,
+            choice_type=0 if rnd is None else rnd.randint(0, 1))
+        choices = [Choice.objects.create(question=question, text=f'choice {j}') for j in range(choices_num)]
+        if rnd is not None:
+            for _, earlier_choices in created:
+                for choice in earlier_choices:
+                    if rnd.random() < condition_density:
+                        Condition.objects.create(question=question, choice=choice,
+                                                 condition_type=rnd.random() < 0.5)
+        created.append((question, choices))
+    poll.refresh_from_db()
+    return poll, created
+
+
+class NextQuestionEnginesTest(TestCase):
+    """Все способы поиска следующего вопроса должны совпадать с search_next_question"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('engines')
+
+    def assert_engines_equal(self, poll, questions, result):
+        answers = Answer.objects.filter(poll_result=result)
+        result.choices = list(answers.values_list('choice_id', flat=True))
+        result.save()
+        tree = get_poll_tree(poll)
+        for question_id in [0] + [question.id for question, _ in questions]:
+            expected = search_next_question(Question.objects.filter(poll=poll, pk__gt=question_id), answers)
+            expected_id = None if expected is None else expected.id
+            self.assertEqual(tree.next_question(question_id, set(result.choices)), expected_id)
+            self.assertEqual(search_next_question_sql(poll.id, question_id, result), expected)
+            for engine in ['tree', 'sql']:
+                with override_settings(POLLS_NEXT_QUESTION_ENGINE=engine):
+                    self.assertEqual(find_next_question(poll, question_id, result), expected)
+
+    def test_random_polls(self):
+        rnd = Random(2024)
+        for i in range(6):
+            poll, questions = create_poll(f'random_{i}', 8, choices_num=3, rnd=rnd, condition_density=0.3)
+            result = PollResult.objects.create(poll=poll, user=self.user)
+            for _ in range(10):
+                Answer.objects.filter(poll_result=result).delete()
+                for question, choices in questions:
+                    for choice in rnd.sample(choices, rnd.randint(0, 1 if question.choice_type == 0 else 3)):
+                        Answer.objects.create(poll_result=result, choice=choice)
+                self.assert_engines_equal(poll, questions, result)
+
+    def test_hide_wins_over_show(self):
+        poll, questions = create_poll('hide_wins', 3)
+        (_, (show, _)), (second, (hide, _)), (third, _) = questions
+        Condition.objects.create(question=third, choice=show, condition_type=True)
+        Condition.objects.create(question=third, choice=hide, condition_type=False)
+        poll.refresh_from_db()
+        result = PollResult.objects.create(poll=poll, user=self.user)
+        Answer.objects.create(poll_result=result, choice=show)
+        Answer.objects.create(poll_result=result, choice=hide)
+        self.assert_engines_equal(poll, questions, result)
+        for engine in ['tree', 'sql', 'loop']:
+            with self.subTest(engine=engine), override_settings(POLLS_NEXT_QUESTION_ENGINE=engine):
+                self.assertIsNone(find_next_question(poll, second.id, result))
+
+    def test_tree_follows_poll_changes(self):
+        poll, questions = create_poll('changes', 2)
+        (first, (choice, _)), (second, _) = questions
+        result = PollResult.objects.create(poll=poll, user=self.user)
+        Answer.objects.create(poll_result=result, choice=choice)
+        self.assertEqual(get_poll_tree(poll).next_question(first.id, {choice.id}), second.id)
+        Condition.objects.create(question=second, choice=choice, condition_type=False)
+        poll.refresh_from_db()
+        self.assertIsNone(get_poll_tree(poll).next_question(first.id, {choice.id}))
+        self.assert_engines_equal(poll, questions, result)
+
+    def test_replay_follows_next_question(self):
+        rnd = Random(2025)
+        for i in range(4):
+            poll, questions = create_poll(f'replay_{i}', 8, choices_num=3, rnd=rnd, condition_density=0.3)
+            tree = get_poll_tree(poll)
+            submitted = {question.id: set(choice.id for choice in rnd.sample(choices, 1 if question.choice_type == 0
+                                                                               else rnd.randint(1, 3)))
+                         for question, choices in questions}
+            path, chosen, question_id = [], set(), tree.next_question(0, set())
+            while question_id is not None:
+                path.append(question_id)
+                chosen |= submitted[question_id]
+                question_id = tree.next_question(question_id, chosen)
+            self.assertEqual([node.id for node, _ in tree.replay(submitted)], path)
+
+
+class QueryCountTest(TestCase):
+    """
+    Число запросов на страницах опроса фиксированной формы: 3 вопроса по 2 варианта, третий вопрос скрывается
+    вторым вариантом первого. Кэши прогреваются заранее, считаются запросы повторного обращения.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('queries')
+        cls.poll, cls.questions = create_poll('fixed', 3)
+        (_, (_, hide)), _, (third, _) = cls.questions
+        Condition.objects.create(question=third, choice=hide, condition_type=False)
+        cls.poll.refresh_from_db()
+        rebuild_counters(cls.poll)
+
+    def setUp(self):
+        # id опросов в разных тестах совпадают, кэши процесса от других тестов не подходят
+        cache.clear()
+        _trees.clear()
+        self.client.force_login(self.user)
+        self.vote_url = reverse('polls:vote', args=[self.poll.id])
+
+    def answer(self, question_num, choice_num=0):
+        question, choices = self.questions[question_num]
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.vote_url, {"question": question.id, "radio": choices[choice_num].id})
+
+    def test_list(self):
+        # Сессия, пользователь и страница опросов, по номеру страницы еще COUNT(*), без кэша пройденные опросы -
+        # подзапрос
+        for pagination, cached, queries in [('pages', False, 4), ('keyset', True, 3)]:
+            with self.subTest(pagination=pagination), override_settings(POLLS_LIST_PAGINATION=pagination,
+                                                                        POLLS_CACHE_COMPLETED_POLLS=cached):
+                self.client.get(reverse('polls:list'))
+                with self.assertNumQueries(queries):
+                    response = self.client.get(reverse('polls:list'))
+                self.assertContains(response, 'fixed')
+
+    def test_vote_first_question(self):
+        self.client.get(self.vote_url)
+        with self.assertNumQueries(5):
+            response = self.client.get(self.vote_url)
+        self.assertContains(response, self.questions[0][0].text)
+
+    def test_vote_answer(self):
+        self.answer(0)
+        with self.assertNumQueries(17):
+            response = self.answer(1)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(PollResult.objects.get().current_question_id, self.questions[1][0].id)
+
+    def test_vote_next_question(self):
+        self.answer(0)
+        url = f'{self.vote_url}?question={self.questions[0][0].id}'
+        self.client.get(url)
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, self.questions[1][0].text)
+
+    def test_vote_finish(self):
+        self.answer(0, choice_num=1)
+        self.answer(1)
+        get_poll_tree(self.poll)
+        with self.assertNumQueries(8):
+            response = self.client.get(f'{self.vote_url}?question={self.questions[1][0].id}')
+        self.assertRedirects(response, reverse('polls:result', args=[self.poll.id]), fetch_redirect_response=False)
+
+    def test_result(self):
+        self.answer(0, choice_num=1)
+        self.answer(1)
+        get_poll_tree(self.poll)
+        for snapshots, queries in [(True, 3), (False, 6)]:
+            with self.subTest(snapshots=snapshots), override_settings(POLLS_RESULT_SNAPSHOTS=snapshots):
+                PollResult.objects.update(finished=False, snapshot=None)
+                self.client.get(f'{self.vote_url}?question={self.questions[1][0].id}')
+                with self.assertNumQueries(queries):
+                    response = self.client.get(reverse('polls:result', args=[self.poll.id]))
+                self.assertContains(response, self.questions[1][0].text)
+
+
+class SaveAnswersTest(TestCase):
+    """Сохранение ответов: ограничение на один ответ и число запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('answers')
+        cls.poll, cls.questions = create_poll('answers', 3, choices_num=4)
+        Question.objects.filter(id__in=[question.id for question, _ in cls.questions[1:]]).update(choice_type=1)
+        for question, _ in cls.questions[1:]:
+            question.choice_type = 1
+
+    def test_unique_single_answer(self):
+        (question, (first, second, *_)), *_ = self.questions
+        result = PollResult.objects.create(poll=self.poll, user=self.user)
+        Answer.objects.create(poll_result=result, choice=first)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Answer.objects.create(poll_result=result, choice=second)
+        with self.captureOnCommitCallbacks(execute=True):
+            save_answers(self.poll.id, self.user, question, [second])
+        self.assertEqual(list(Answer.objects.values_list('choice_id', flat=True)), [first.id])
+
+    def test_revote_is_scoped_to_poll(self):
+        self.client.force_login(self.user)
+        other, [(foreign, _)] = create_poll('answers other', 1)
+        (question, _), *_ = self.questions
+        url = reverse('polls:vote', args=[self.poll.id])
+        self.assertContains(self.client.get(url, {"question": question.id, "invalid": 1}), question.text)
+        self.assertEqual(self.client.get(url, {"question": foreign.id, "invalid": 1}).status_code, 404)
+
+    def test_queries_do_not_grow_with_choices(self):
+        (question, choices), *multiple = self.questions
+        save_answers(self.poll.id, self.user, question, choices[:1])
+        queries = []
+        for (question, choices), number in zip(multiple, [1, 4]):
+            with CaptureQueriesContext(connection) as context:
+                save_answers(self.poll.id, self.user, question, choices[:number])
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+        self.assertEqual(Answer.objects.count(), 6)
+
+
+class CountersTest(TestCase):
+    """Счетчики, которые обновляет save_answers, совпадают с пересчетом rebuild_poll_counters"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.poll, cls.questions = create_poll('counters', 3, choices_num=3)
+        Question.objects.filter(pk=cls.questions[1][0].pk).update(choice_type=1)
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        self.url = reverse('polls:vote', args=[self.poll.id])
+
+    def vote(self, user, question_num, *choice_nums):
+        question, choices = self.questions[question_num]
+        data = {"question": question.id}
+        if question_num == 1:
+            data.update({f'checkbox_{choices[num].id}': choices[num].id for num in choice_nums})
+        else:
+            data["radio"] = choices[choice_nums[0]].id
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, data)
+
+    def counters(self):
+        questions = [question for question, _ in self.questions]
+        choices = [choice for _, question_choices in self.questions for choice in question_choices]
+        question_counters = {counter.pk: counter for counter in QuestionCounter.objects.filter(question__in=questions)}
+        choice_counters = {counter.pk: counter for counter in ChoiceCounter.objects.filter(choice__in=choices)}
+        poll = PollCounter.objects.filter(poll=self.poll).first() or PollCounter()
+        return ((poll.respondents, poll.answers),
+                [(counter.respondents, counter.answers, counter.stopped) for counter in
+                 (question_counters.get(question.id, QuestionCounter()) for question in questions)],
+                [choice_counters.get(choice.id, ChoiceCounter()).answers for choice in choices])
+
+    def test_incremental_counters_match_rebuild(self):
+        first, second, third = [User.objects.create_user(f'counters_{i}') for i in range(3)]
+        self.vote(first, 0, 0)
+        self.vote(first, 1, 0)
+        self.vote(first, 1, 0, 1)  # Повторный ответ добавляет choice к вопросу с несколькими вариантами
+        self.vote(first, 2, 2)
+        self.client.get(f'{self.url}?question={self.questions[2][0].id}')  # Завершение опроса
+        self.vote(second, 0, 1)
+        self.vote(second, 0, 0)  # Повторный ответ на вопрос с одним вариантом отклоняется
+        self.vote(second, 2, 1)
+        self.vote(third, 0, 2)
+        self.assertTrue(PollResult.objects.get(user=first).finished)
+        counters = self.counters()
+        self.assertEqual(counters[0], (3, 7))
+        call_command('rebuild_poll_counters', self.poll.id, stdout=io.StringIO())
+        self.assertEqual(self.counters(), counters)
+
+
+class ExportTest(TestCase):
+    """Выгрузка ответов для сотрудников"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('export_staff', is_staff=True)
+        cls.poll, cls.questions = create_poll('export', 2)
+        for user, choice_num in [(User.objects.create_user('export_1'), 0), (User.objects.create_user('export_2'), 1)]:
+            for question, choices in cls.questions:
+                save_answers(cls.poll.id, user, question, [choices[choice_num]])
+
+    def setUp(self):
+        self.url = reverse('polls:export', args=[self.poll.id])
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('export_user'))
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.url, {"format": "xml"}).status_code, 400)
+
+    def test_csv(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(f'poll_{self.poll.id}.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        columns = [f'q{question.id}_c{choice.id}' for question, choices in self.questions for choice in choices]
+        self.assertEqual(rows[0], ['result', 'user'] + columns)
+        self.assertEqual([row[1:] for row in rows[1:]], [['export_1', '1', '', '1', ''], ['export_2', '', '1', '', '1']])
+
+    def test_gzip(self):
+        self.client.force_login(self.staff)
+        plain = b''.join(self.client.get(self.url, {"format": "ndjson"}).streaming_content)
+        response = self.client.get(self.url, {"format": "ndjson", "gzip": "1"})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn(f'poll_{self.poll.id}.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+        self.assertEqual(len(plain.splitlines()), 2)
+
+
+class FragmentCacheTest(TestCase):
+    """Кэш отрендеренных форм вопросов по версии опроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('fragments')
+        cls.poll, cls.questions = create_poll('fragments', 1)
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('polls:vote', args=[self.poll.id])
+
+    def test_hit_and_invalidation(self):
+        (question, (choice, _)), = self.questions
+        with patch('polls.fragments.render_to_string', wraps=fragments.render_to_string) as render:
+            self.assertContains(self.client.get(self.url), question.text)
+            self.assertContains(self.client.get(self.url), question.text)
+            self.assertEqual(render.call_count, 1)
+            question.text = 'edited question'
+            question.save()
+            self.assertContains(self.client.get(self.url), 'edited question')
+            choice.text = 'edited choice'
+            choice.save()
+            self.assertContains(self.client.get(self.url), 'edited choice')
+            self.assertEqual(render.call_count, 3)
+
+
+class VotePageTest(TestCase):
+    """Опрос на одной странице: все ответы одним POST"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('vote_page')
+        cls.poll, cls.questions = create_poll('vote_page', 3)
+        (_, (_, hide)), _, (third, _) = cls.questions
+        Condition.objects.create(question=third, choice=hide, condition_type=False)
+        Poll.objects.filter(pk=cls.poll.pk).update(single_page=True)
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('polls:vote', args=[self.poll.id])
+
+    def test_post(self):
+        (first, (_, hide)), (second, (choice, _)), _ = self.questions
+        self.assertContains(self.client.get(self.url), f'name="question_{second.id}"')
+        response = self.client.post(self.url, {f'question_{first.id}': hide.id})  # Второй вопрос без ответа
+        self.assertContains(response, 'Please answer all shown questions')
+        self.assertIn(hide.id, response.context["selected"])
+        self.assertFalse(PollResult.objects.filter(finished=True).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {f'question_{first.id}': hide.id, f'question_{second.id}': choice.id})
+        self.assertRedirects(response, reverse('polls:result', args=[self.poll.id]), fetch_redirect_response=False)
+        result = PollResult.objects.get(user=self.user)
+        self.assertTrue(result.finished)
+        self.assertEqual(sorted(Answer.objects.values_list('choice_id', flat=True)), sorted([hide.id, choice.id]))
+        self.assertRedirects(self.client.get(self.url), reverse('polls:result', args=[self.poll.id]),
+                             fetch_redirect_response=False)
+        response = self.client.post(self.url, {f'question_{first.id}': hide.id, f'question_{second.id}': choice.id})
+        self.assertContains(response, 'Please answer all shown questions')
+        self.assertEqual(Answer.objects.count(), 2)
+
+
+class AsyncUrls:
+    """Страницы опросов на асинхронных views, как при POLLS_ASYNC_VIEWS"""
+    urlpatterns = [
+        path('logout/', auth_views.LogoutView.as_view(), name='logout'),
+        path('polls/', include(([
+            path('', async_views.PollsListView.as_view(), name='list'),
+            path('vote/<int:poll_id>', async_views.vote, name='vote'),
+            path('result/<int:poll_id>', async_views.result_poll, name='result'),
+        ], 'polls'))),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewsTest(TestCase):
+    """Асинхронные views списка, прохождения и результатов опроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async')
+        cls.poll, cls.questions = create_poll('async', 2)
+        cls.others = [Poll.objects.create(name=f'async {i}', visibility=True) for i in range(5)]
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+
+    async def test_list(self):
+        url = reverse('polls:list')
+        self.assertEqual((await self.async_client.get(url)).status_code, 302)
+        await self.async_client.aforce_login(self.user)
+        for pagination in ['keyset', 'pages']:
+            with self.subTest(pagination=pagination), override_settings(POLLS_LIST_PAGINATION=pagination):
+                response = await self.async_client.get(url)
+                self.assertEqual([poll.id for poll in response.context["object_list"]],
+                                 [self.poll.id] + [poll.id for poll in self.others[:4]])
+                response = await self.async_client.get(url + response.context["next_url"])
+                self.assertEqual([poll.id for poll in response.context["object_list"]], [self.others[4].id])
+        with override_settings(POLLS_LIST_PAGINATION='keyset'):
+            self.assertEqual((await self.async_client.get(url, {"after": "x"})).status_code, 400)
+
+    async def test_vote_and_result(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('polls:vote', args=[self.poll.id])
+        (first, (first_choice, _)), (second, (second_choice, _)) = self.questions
+        self.assertContains(await self.async_client.get(url), first.text)
+        response = await self.async_client.post(url, {"question": first.id, "radio": second_choice.id})
+        self.assertRedirects(response, f'{url}?question={first.id}&invalid=1', fetch_redirect_response=False)
+        self.assertEqual(await Answer.objects.acount(), 0)
+        for question, choice in [(first, first_choice), (second, second_choice)]:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = await self.async_client.post(url, {"question": question.id, "radio": choice.id})
+            self.assertRedirects(response, f'{url}?question={question.id}', fetch_redirect_response=False)
+            if question == first:  # Прерванный опрос продолжается со следующего вопроса
+                self.assertContains(await self.async_client.get(url), second.text)
+        response = await self.async_client.get(f'{url}?question={second.id}')
+        self.assertRedirects(response, f'/polls/result/{self.poll.id}', fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('polls:result', args=[self.poll.id]))
+        self.assertContains(response, second.text)
+        self.assertEqual(await Answer.objects.filter(choice__in=[first_choice, second_choice]).acount(), 2)
+
+
+class MetricsTest(TestCase):
+    """Замеры запросов в Server-Timing и /metrics"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('metrics')
+        create_poll('metrics', 1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('polls:list'))
+        # Сессия, пользователь, пройденные опросы и страница опросов
+        self.assertIn('desc="4 queries"', response['Server-Timing'])
+        self.assertContains(self.client.get('/metrics'), 'nomia_request_sql_queries_count{view="polls:list"}')
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0.001)
+    def test_slow_request_log(self):
+        with self.assertLogs('nomia', 'WARNING') as logs:
+            self.client.get(reverse('polls:list'))
+        self.assertIn('polls_poll', logs.output[0])
+
+    def test_metrics_access(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.client.force_login(User.objects.create_user('metrics_staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_slowest_statements_are_kept(self):
+        stats = RequestStats()
+        for i in range(SLOW_SQL_LIMIT * 2):
+            stats.add(f'query {i}', i / 1000)
+        self.assertEqual([sql for _, sql in stats.slowest()][:2], [f'query {SLOW_SQL_LIMIT * 2 - 1}',
+                                                                   f'query {SLOW_SQL_LIMIT * 2 - 2}'])
+        self.assertEqual(len(stats.slowest()), SLOW_SQL_LIMIT)
+
+
+class ApiTest(TestCase):
+    """JSON API: список опросов, определение опроса с ETag, ответы и результаты"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('api')
+        cls.poll, cls.questions = create_poll('api', 2)
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        self.client.force_login(self.user)
+
+    def test_list(self):
+        response = self.client.get(reverse('polls:api_list'))
+        self.assertEqual([poll["id"] for poll in response.json()["polls"]], [self.poll.id])
+        self.assertEqual(self.client.get(reverse('polls:api_list'), {"done": 1}).json()["polls"], [])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('polls:api_list')).status_code, 401)
+
+    def test_definition_etag(self):
+        url = reverse('polls:api_poll', args=[self.poll.id])
+        response = self.client.get(url)
+        self.assertEqual([question["id"] for question in response.json()["questions"]],
+                         [question.id for question, _ in self.questions])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        question, _ = self.questions[0]
+        question.text = 'edited'
+        question.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_answers_and_result(self):
+        url = reverse('polls:api_answers', args=[self.poll.id])
+        answers = {str(question.id): [choices[0].id] for question, choices in self.questions}
+        self.assertEqual(self.client.post(url, 'not json', content_type='application/json').status_code, 400)
+        foreign = {str(self.questions[0][0].id): [self.questions[1][1][0].id]}
+        self.assertEqual(self.client.post(url, {"answers": foreign}, content_type='application/json').status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {"answers": answers}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        result = self.client.get(reverse('polls:api_result', args=[self.poll.id])).json()
+        self.assertTrue(result["finished"])
+        self.assertEqual([[choice["checked"] for choice in question["choices"]] for question in result["questions"]],
+                         [[True, False], [True, False]])
+
+
+class PollsListTest(TestCase):
+    """Постраничный вывод списка по ключу и кэш пройденных опросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('list')
+        cls.polls = [Poll.objects.create(name=f'list {i}', visibility=True) for i in range(7)]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def page(self, url):
+        context = self.client.get(url).context
+        return [poll.id for poll in context["object_list"]], context["previous_url"], context["next_url"]
+
+    @override_settings(POLLS_LIST_PAGINATION='keyset')
+    def test_keyset_pages(self):
+        ids = [poll.id for poll in self.polls]
+        url = reverse('polls:list')
+        first, previous_url, next_url = self.page(url)
+        self.assertEqual((first, previous_url), (ids[:5], None))
+        second, previous_url, next_url = self.page(url + next_url)
+        self.assertEqual((second, next_url), (ids[5:], None))
+        self.assertEqual(self.page(url + previous_url)[0], ids[:5])
+        for query in ['?after=x', '?before=1.5']:
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(url + query).status_code, 400)
+
+    @override_settings(POLLS_CACHE_COMPLETED_POLLS=True)
+    def test_completed_polls_cache(self):
+        self.assertEqual(completed_poll_ids(self.user), [])
+        with self.assertNumQueries(0):
+            completed_poll_ids(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            PollResult.objects.create(poll=self.polls[0], user=self.user)
+        # Список прочитан из базы до коммита второго PollResult, а записан в кэш после сброса
+        filter_results = PollResult.objects.filter
+
+        def read_before_commit(*args, **kwargs):
+            stale = list(filter_results(*args, **kwargs).values_list('poll_id', flat=True))
+            with self.captureOnCommitCallbacks(execute=True):
+                PollResult.objects.create(poll=self.polls[1], user=self.user)
+            return Mock(values_list=Mock(return_value=stale))
+        with patch.object(PollResult.objects, 'filter', read_before_commit):
+            self.assertEqual(completed_poll_ids(self.user), [self.polls[0].id])
+        self.assertEqual(completed_poll_ids(self.user), [self.polls[0].id, self.polls[1].id])
+
+
+class PollDefinitionsTest(TestCase):
+    """Выгрузка и загрузка описаний опросов"""
+
+    def test_round_trip(self):
+        for i in range(3):
+            create_poll(f'definitions_{i}', 6, choices_num=3, rnd=Random(i), condition_density=0.3)
+        exported = export_definitions(Poll.objects.all())
+        polls = import_definitions(exported)
+        self.assertEqual(export_definitions(Poll.objects.filter(id__in=[poll.id for poll in polls])), exported)
+        for poll in polls:
+            poll.full_clean()
+        for condition in Condition.objects.filter(question__poll__in=polls).select_related('question', 'choice'):
+            condition.full_clean()
+
+    def test_invalid_definitions(self):
+        data = {"polls": [{"name": "invalid", "visibility": True, "questions": [
+            {"text": "first", "default": False, "choices": ["a"]},
+            {"text": "second", "choices": ["a", "b"], "conditions": [{"question": 1, "choice": 0, "show": True},
+                                                                    {"question": 0, "choice": 5, "show": True}]},
+        ]}]}
+        with self.assertRaises(ValidationError) as raised:
+            import_definitions(data)
+        self.assertEqual(len(raised.exception.messages), 4)
+        self.assertFalse(Poll.objects.filter(name='invalid').exists())
+
+    def test_malformed_entries(self):
+        question = {"text": "question", "choices": ["a", "b"]}
+        for polls in [["poll"], [{"name": "poll", "questions": {}}], [{"name": "poll", "questions": [question, 1]}],
+                      [{"name": "poll", "questions": [{**question, "choices": "ab"}]}],
+                      [{"name": "poll", "questions": [question, {**question, "conditions": [[0, 0]]}]}],
+                      [{"name": "poll", "questions": [{**question, "choice_type": []}]}]]:
+            with self.subTest(polls=polls), self.assertRaises(ValidationError) as raised:
+                import_definitions({"polls": polls})
+            self.assertEqual(len(raised.exception.messages), 1)
+        self.assertFalse(Poll.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ProvisionUsersTest(TestCase):
+    """Создание пользователей из файла"""
+
+    def test_iter_users(self):
+        users = [{"username": f'user_{i}', "password": f'password {i}' * 5} for i in range(300)]
+        data = json.dumps({"dscr": "data", "data": users}, indent=2)
+        with patch('polls.provisioning.READ_SIZE', 7):
+            self.assertEqual(list(iter_users(io.StringIO(data))), users)
+            self.assertEqual(list(iter_users(io.StringIO(json.dumps(users)), key=None)), users)
+
+    def test_provision_users(self):
+        User.objects.create_user('existing')
+        users = [{"username": name, "password": 'secret', "email": f'{name}@example.com'}
+                 for name in ['existing', 'first', 'second', 'first']]
+        self.assertEqual(provision_users(users, batch_size=2, workers=2), (4, 2))
+        self.assertTrue(User.objects.get(username='second').check_password('secret'))
+        self.assertEqual(provision_users(users, workers=1), (4, 0))
+
+    def test_concurrently_created_users_are_not_counted(self):
+        bulk_create = User.objects.bulk_create
+
+        def concurrent_bulk_create(objs, **kwargs):
+            User.objects.create_user('third')  # Другой процесс успел создать пользователя после проверки
+            return bulk_create(objs, **kwargs)
+
+        users = [{"username": name, "password": 'secret'} for name in ['third', 'fourth']]
+        with patch.object(User.objects, 'bulk_create', concurrent_bulk_create):
+            self.assertEqual(provision_users(users, workers=1), (2, 1))
+        self.assertFalse(User.objects.get(username='third').check_password('secret'))
+
+
+class ValidatePollsTest(TestCase):
+    """Проверка опросов перед показом пользователям"""
+
+    def test_validate_polls(self):
+        valid = [create_poll(f'valid_{i}', 5)[0] for i in range(5)]
+        _, ((first, (choice, _)),) = create_poll('one_choice', 1)
+        choice.delete()
+        Question.objects.filter(pk=first.pk).update(default=False)
+        empty = Poll.objects.create(name='empty')
+        with self.assertNumQueries(3):  # Опросы и два запроса проверки
+            errors = Poll.validate_polls(Poll.objects.all())
+        self.assertEqual(errors, {
+            first.poll_id: ['No first question in poll one_choice',
+                            f'Each question in poll must have at least two choices. Poll: one_choice. '
+                            f'Invalid_questions: {first.id}'],
+            empty.id: ['Poll must have at least one question. Poll: empty.'],
+        })
+        empty.visibility = True
+        with self.assertRaises(ValidationError):
+            empty.full_clean()
+        valid[0].full_clean()
+
+    def test_make_visible(self):
+        valid, _ = create_poll('valid', 2)
+        empty = Poll.objects.create(name='empty')
+        Poll.objects.update(visibility=False)
+        self.client.force_login(User.objects.create_superuser('admin_validate'))
+        url = reverse('admin:polls_poll_changelist')
+        self.client.post(url, {"action": "make_visible", "_selected_action": [valid.id, empty.id]})
+        self.assertFalse(Poll.objects.filter(visibility=True).exists())
+        self.client.post(url, {"action": "make_visible", "_selected_action": [valid.id]})
+        self.assertEqual(list(Poll.objects.filter(visibility=True)), [valid])
+
+
+class ReachabilityTest(TestCase):
+    """Индекс достижимости дерева опроса"""
+
+    def test_dead_questions_and_progress(self):
+        poll, questions = create_poll('reachability', 5)
+        (first, (a, b)), (second, (c, _)), (third, _), (fourth, _), (fifth, _) = questions
+        Question.objects.filter(pk__in=[third.pk, fourth.pk, fifth.pk]).update(default=False)
+        Condition.objects.create(question=third, choice=c, condition_type=True)
+        Condition.objects.create(question=fourth, choice=a, condition_type=False)
+        Condition.objects.create(question=fourth, choice=b, condition_type=False)
+        Condition.objects.create(question=fourth, choice=c, condition_type=True)
+        Poll.bump_version(pk=poll.pk)
+        poll.refresh_from_db()
+        tree = get_poll_tree(poll)
+        # Пятый вопрос никто не показывает, четвертый скрывает любой ответ на первый вопрос
+        self.assertEqual(tree.dead, {fourth.id, fifth.id})
+        self.assertEqual(tree.max_path_length, 3)
+        self.assertEqual(tree.progress(first.id, set()), (1, 3))
+        self.assertEqual(tree.progress(second.id, {a.id}), (2, 3))
+        self.assertIsNone(tree.next_question(second.id, {a.id}))
+        self.assertEqual(tree.next_question(second.id, {a.id, c.id}), third.id)
+        self.assertEqual(tree.suffix_show[tree.ids.index(fifth.id)], frozenset())
+
+    def test_publish_warns_about_dead_questions(self):
+        poll, (_, (second, _)) = create_poll('dead_on_publish', 2)
+        Question.objects.filter(pk=second.pk).update(default=False)
+        Poll.objects.update(visibility=False)
+        self.client.force_login(User.objects.create_superuser('admin_reachability'))
+        response = self.client.post(reverse('admin:polls_poll_changelist'),
+                                    {"action": "make_visible", "_selected_action": [poll.id]}, follow=True)
+        self.assertContains(response, f'Questions {second.id} of poll dead_on_publish can never be shown.')
+
+    def test_publish_queries_do_not_grow_with_polls(self):
+        self.client.force_login(User.objects.create_superuser('admin_publish'))
+        url = reverse('admin:polls_poll_changelist')
+        queries = []
+        for polls_num in [1, 10]:
+            polls = [create_poll(f'publish_{polls_num}_{i}', 2)[0] for i in range(polls_num)]
+            Poll.objects.update(visibility=False)
+            with CaptureQueriesContext(connection) as captured:
+                self.client.post(url, {"action": "make_visible", "_selected_action": [poll.id for poll in polls]})
+            queries.append(len(captured))
+            self.assertEqual(Poll.objects.filter(visibility=True).count(), polls_num)
+        self.assertEqual(queries[0], queries[1])
+
+
+class AnswerJournalTest(TestCase):
+    """Отложенная запись ответов через журнал"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('journal')
+        cls.poll, cls.questions = create_poll('journal', 3)
+        (_, (show, _)), (second, _), _ = cls.questions
+        Question.objects.filter(pk=second.pk).update(default=False)
+        Condition.objects.create(question=second, choice=show, condition_type=True)
+        cls.poll.refresh_from_db()
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        journal = override_settings(POLLS_ANSWER_JOURNAL=os.path.join(directory.name, 'journal.sqlite3'))
+        journal.enable()
+        self.addCleanup(journal.disable)
+        self.client.force_login(self.user)
+        self.vote_url = reverse('polls:vote', args=[self.poll.id])
+
+    def answer(self, question_num, choice_num=0):
+        question, choices = self.questions[question_num]
+        return self.client.post(self.vote_url, {"question": question.id, "radio": choices[choice_num].id})
+
+    def test_next_question_sees_pending_answers(self):
+        self.answer(0)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(len(pending_answers(self.poll.id, self.user.id)), 1)
+        for engine in ['tree', 'sql', 'loop']:
+            with self.subTest(engine=engine), override_settings(POLLS_NEXT_QUESTION_ENGINE=engine):
+                response = self.client.get(self.vote_url)
+                self.assertEqual(response.context['question'], self.questions[1][0])
+
+    def test_flush(self):
+        self.answer(0)
+        self.answer(0, choice_num=1)  # Повторный ответ на вопрос с одним вариантом ответа не сохраняется
+        self.answer(1)
+        self.assertEqual(flush_answers(), 3)
+        self.assertEqual(flush_answers(), 0)
+        result = PollResult.objects.get()
+        self.assertEqual(result.choices, [self.questions[0][1][0].id, self.questions[1][1][0].id])
+        self.assertEqual(result.current_question_id, self.questions[1][0].id)
+        statistics = poll_statistics(self.poll)
+        rebuild_counters(self.poll)
+        self.assertEqual(poll_statistics(self.poll), statistics)
+
+    def test_second_single_answer_is_ignored(self):
+        self.answer(0, choice_num=1)
+        self.answer(0, choice_num=0)  # Показал бы второй вопрос, но при переносе будет отброшен
+        for engine in ['tree', 'sql', 'loop']:
+            with self.subTest(engine=engine), override_settings(POLLS_NEXT_QUESTION_ENGINE=engine):
+                response = self.client.get(self.vote_url)
+                self.assertEqual(response.context['question'], self.questions[2][0])
+        flush_answers()
+        self.assertEqual(PollResult.objects.get().choices, [self.questions[0][1][1].id])
+        self.assertEqual(self.client.get(self.vote_url).context['question'], self.questions[2][0])
+
+    def test_result_flushes_pending_answers(self):
+        self.answer(0, choice_num=1)
+        response = self.client.get(f'{self.vote_url}?question={self.questions[0][0].id}')
+        self.assertContains(response, self.questions[2][0].text)
+        self.answer(2)
+        response = self.client.get(f'{self.vote_url}?question={self.questions[2][0].id}')
+        self.assertRedirects(response, reverse('polls:result', args=[self.poll.id]), fetch_redirect_response=False)
+        self.assertEqual(pending_answers(self.poll.id, self.user.id), [])
+        self.assertTrue(PollResult.objects.get().finished)
+        self.assertContains(self.client.get(reverse('polls:result', args=[self.poll.id])), self.questions[2][0].text)
+
+    def test_entries_of_deleted_choices_are_dropped(self):
+        self.answer(0, choice_num=1)
+        self.answer(2)
+        other = User.objects.create_user('journal_other')
+        question, choices = self.questions[2]
+        append_answers(self.poll.id, other.id, question, [choices[1].id])
+        self.questions[0][1][1].delete()
+        with self.assertLogs('polls', 'WARNING') as logs:
+            self.assertEqual(flush_answers(), 3)
+        self.assertIn('Dropped 1 journal entries of deleted', logs.output[0])
+        self.assertEqual(flush_answers(), 0)  # Журнал не застревает на записи с удаленным choice
+        self.assertEqual(PollResult.objects.get(user=self.user).choices, [choices[0].id])
+        self.assertEqual(PollResult.objects.get(user=other).choices, [choices[1].id])
+
+    def test_result_reads_journal_without_locking(self):
+        self.answer(0, choice_num=1)
+        self.answer(2)
+        flush_answers()
+        statements, connect = [], sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            journal = connect(*args, **kwargs)
+            journal.set_trace_callback(statements.append)
+            return journal
+
+        with patch('polls.journal.sqlite3.connect', traced_connect):
+            self.assertEqual(self.client.get(reverse('polls:result', args=[self.poll.id])).status_code, 200)
+            self.assertEqual(self.client.get(reverse('polls:api_result', args=[self.poll.id])).status_code, 200)
+        self.assertTrue(statements)
+        self.assertNotIn('BEGIN IMMEDIATE', statements)
+
+
+@skipUnless(archive.np, "numpy is not installed")
+class PollArchiveTest(TestCase):
+    """Перенос ответов закрытого опроса в архив"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'archive{i}') for i in range(3)]
+        cls.poll, cls.questions = create_poll('archive', 3)
+
+    def setUp(self):
+        cache.clear()
+        _trees.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = directory.name
+        archive_dir = override_settings(POLLS_ARCHIVE_DIR=directory.name, POLLS_RESULT_SNAPSHOTS=False)
+        archive_dir.enable()
+        self.addCleanup(archive_dir.disable)
+        vote_url = reverse('polls:vote', args=[self.poll.id])
+        for i, user in enumerate(self.users):
+            self.client.force_login(user)
+            for question, choices in self.questions[:i + 1]:
+                self.client.post(vote_url, {"question": question.id, "radio": choices[i % 2].id})
+        Poll.objects.filter(pk=self.poll.pk).update(visibility=False)
+        self.poll.refresh_from_db()
+
+    def test_archive(self):
+        pages = {}
+        for user in self.users:
+            self.client.force_login(user)
+            pages[user.id] = self.client.get(reverse('polls:result', args=[self.poll.id])).context['questions']
+        exported = b''.join(export_poll(self.poll, 'ndjson'))
+
+        self.assertEqual(archive.archive_poll(self.poll), 6)
+        self.poll.refresh_from_db()
+        self.assertTrue(self.poll.archived)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(PollResult.objects.filter(poll=self.poll).count(), 3)
+        for user in self.users:
+            self.client.force_login(user)
+            response = self.client.get(reverse('polls:result', args=[self.poll.id]))
+            self.assertEqual(response.context['questions'], pages[user.id])
+        self.assertEqual(b''.join(export_poll(self.poll, 'ndjson')), exported)
+        self.assertIn(self.poll.id, Poll.validate_polls([self.poll]))
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_poll(self.poll)
+
+    def test_mismatch_keeps_answers(self):
+        real_write = archive.write_archive
+
+        def write_and_answer(poll):
+            path = real_write(poll)
+            question, choices = self.questions[1]
+            Answer.objects.create(poll_result=PollResult.objects.get(user=self.users[0]), choice=choices[0])
+            return path
+
+        with patch.object(archive, 'write_archive', write_and_answer), self.assertRaises(archive.ArchiveError):
+            archive.archive_poll(self.poll)
+        self.assertEqual(Answer.objects.count(), 7)
+        self.assertFalse(Poll.objects.get(pk=self.poll.pk).archived)
+        self.assertEqual(os.listdir(self.archive_dir), [])
+
+    def test_concurrent_run_keeps_archive(self):
+        stale = Poll.objects.get(pk=self.poll.pk)
+        archive.archive_poll(self.poll)
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_poll(stale)  # Второй запуск начался до того, как первый пометил опрос архивным
+        self.assertEqual(os.listdir(self.archive_dir), [f'poll_{self.poll.id}'])
+        self.assertEqual(len(archive.open_archive(self.poll.id)['result']), 6)
+
+    def test_journal_entries_of_archived_poll_are_dropped(self):
+        archive.archive_poll(self.poll)
+        question, choices = self.questions[2]
+        with self.assertLogs('polls', 'WARNING'):
+            self.assertEqual(apply_entries([(self.poll.id, self.users[0].id, question.id, 1, [choices[0].id])]), 0)
+        self.assertFalse(Answer.objects.exists())
+
+    def test_visible_poll_is_not_archived(self):
+        Poll.objects.filter(pk=self.poll.pk).update(visibility=True)
+        self.poll.refresh_from_db()
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_poll(self.poll)
+        self.assertEqual(Answer.objects.count(), 6)
+
+
+@skipUnless(archive.np, "numpy is not installed")
+class AnalyticsTest(TestCase):
+    """Срезы ответов по матрице респондент x choice"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.poll, cls.questions = create_poll('analytics', 3)
+        rnd = Random(3)
+        for i in range(20):
+            result = PollResult.objects.create(poll=cls.poll, user=User.objects.create_user(f'analytics{i}'))
+            for question, choices in cls.questions[:rnd.randint(1, 3)]:
+                Answer.objects.create(poll_result=result, choice=rnd.choice(choices))
+        rebuild_counters(cls.poll)
+
+    def setUp(self):
+        analytics._matrices.clear()
+
+    def test_matches_orm(self):
+        (first, first_choices), _, (third, third_choices) = self.questions
+        matrix = analytics.get_matrix(self.poll)
+        table = matrix.crosstab(first.id, third.id)
+        for i, row_choice in enumerate(first_choices):
+            for j, column_choice in enumerate(third_choices):
+                self.assertEqual(table[i][j], PollResult.objects.filter(answer__choice=row_choice)
+                                 .filter(answer__choice=column_choice).count())
+        segment = matrix.segment(include=[first_choices[0].id], exclude=[third_choices[1].id])
+        expected = PollResult.objects.filter(answer__choice=first_choices[0]).exclude(answer__choice=third_choices[1])
+        self.assertEqual(set(matrix.results[segment].tolist()), set(expected.values_list('id', flat=True)))
+        answered, shares = matrix.distribution(third.id, segment)
+        self.assertEqual(answered, expected.filter(answer__question=third).count())
+        self.assertEqual(shares[third_choices[1].id], 0)
+        with self.assertRaises(KeyError):
+            matrix.segment(include=[0])
+
+    def test_cache(self):
+        matrix = analytics.get_matrix(self.poll)
+        with self.assertNumQueries(1):
+            self.assertIs(analytics.get_matrix(self.poll), matrix)
+        question, choices = self.questions[2]
+        result = PollResult.objects.exclude(answer__question=question).first()
+        Answer.objects.create(poll_result=result, choice=choices[0])
+        rebuild_counters(self.poll)
+        self.assertEqual(analytics.get_matrix(self.poll).respondents, matrix.respondents)
+        self.assertIsNot(analytics.get_matrix(self.poll), matrix)
+        matrix = analytics.get_matrix(self.poll)
+        PollResult.objects.filter(id=result.id).delete()  # Счетчики при удалении не пересчитываются
+        self.assertEqual(analytics.get_matrix(self.poll).respondents, matrix.respondents - 1)
+        with override_settings(POLLS_ANALYTICS_CACHE_SIZE=1):
+            other, _ = create_poll('analytics other', 1)
+            analytics.get_matrix(other)
+        self.assertEqual(list(analytics._matrices), [other.id])
+
+    def test_admin_and_command(self):
+        (first, first_choices), (second, _), _ = self.questions
+        self.client.force_login(User.objects.create_superuser('admin_analytics'))
+        response = self.client.get(reverse('admin:polls_poll_analytics', args=[self.poll.id]),
+                                   {"include": first_choices[0].id, "row": first.id, "column": second.id})
+        self.assertEqual(response.status_code, 200)
+        report = response.context['analytics']
+        self.assertEqual(report['segment'], PollResult.objects.filter(answer__choice=first_choices[0]).count())
+        self.assertEqual(len(report['crosstab']['rows']), 2)
+        out = io.StringIO()
+        call_command('poll_analytics', self.poll.id, '--include', str(first_choices[0].id),
+                     '--crosstab', str(first.id), str(second.id), stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), report)
+
+
+class AdminScaleTest(TestCase):
+    """Админка на больших опросах"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin_scale')
+        cls.poll, cls.questions = create_poll('admin', 3)
+        cls.other, _ = create_poll('admin other', 2)
+        cls.poll.refresh_from_db()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists_do_not_query_per_row(self):
+        create_poll('admin few', 3, rnd=Random(0), condition_density=0.5)
+        for model in ['question', 'condition']:
+            url = reverse(f'admin:polls_{model}_changelist')
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(url)
+            create_poll('admin more', 8, rnd=Random(1), condition_density=0.5)
+            with CaptureQueriesContext(connection) as many:
+                self.client.get(url)
+            self.assertEqual(len(many), len(few), model)
+
+    def test_autocomplete_is_scoped_to_poll(self):
+        (first, first_choices), (second, second_choices), (third, _) = self.questions
+        self.assertContains(self.client.get(reverse('admin:polls_question_change', args=[third.id])),
+                            'name="condition_set-0-choice"')
+        response = self.client.get(reverse('admin:autocomplete'), {
+            "app_label": "polls", "model_name": "condition", "field_name": "choice"},
+            HTTP_REFERER=reverse('admin:polls_question_change', args=[third.id]))
+        self.assertEqual({int(item['id']) for item in response.json()['results']},
+                         {choice.id for choice in first_choices + second_choices})
+        response = self.client.get(reverse('admin:autocomplete'), {
+            "app_label": "polls", "model_name": "condition", "field_name": "question"},
+            HTTP_REFERER=reverse('admin:polls_condition_add') + f'?question={second.id}')
+        self.assertEqual({int(item['id']) for item in response.json()['results']},
+                         {question.id for question, _ in self.questions})
+
+    def test_question_add_page(self):
+        (first, (show, _)), _, _ = self.questions
+        url = reverse('admin:polls_question_add')
+        self.assertNotContains(self.client.get(url), 'condition_set-')
+        response = self.client.post(url, {
+            "poll": self.poll.id, "text": "added", "choice_type": 0, "default": False,
+            "choice_set-TOTAL_FORMS": 2, "choice_set-INITIAL_FORMS": 0,
+            "choice_set-0-text": "a", "choice_set-1-text": "b",
+            "condition_set-TOTAL_FORMS": 1, "condition_set-INITIAL_FORMS": 0,
+            "condition_set-0-choice": show.id, "condition_set-0-condition_type": "on",
+        })
+        self.assertEqual(response.status_code, 302)
+        question = Question.objects.get(text='added')
+        self.assertEqual(question.choice_set.count(), 2)
+        self.assertContains(self.client.get(reverse('admin:polls_question_change', args=[question.id])),
+                            'name="condition_set-0-choice"')
+
+    def test_condition_matrix(self):
+        (first, (show, hide)), (second, (later, _)), (third, _) = self.questions
+        old = Condition.objects.create(question=third, choice=later, condition_type=True)
+        self.poll.refresh_from_db()
+        url = reverse('admin:polls_poll_conditions', args=[self.poll.id])
+        response = self.client.get(url)
+        self.assertEqual(response.context['rows'][2]['cells'][2]['value'], 'show')
+        self.assertIsNone(response.context['rows'][0]['cells'][0])
+        version = self.poll.version
+        response = self.client.post(url, {"version": version, f"condition_{second.id}_{show.id}": "show",
+                                          f"condition_{third.id}_{hide.id}": "hide",
+                                          f"condition_{third.id}_{later.id}": ""})
+        self.assertRedirects(response, url)
+        self.assertEqual(set(Condition.objects.filter(question__poll=self.poll).values_list(
+            'question', 'choice', 'condition_type')), {(second.id, show.id, True), (third.id, hide.id, False)})
+        self.assertFalse(Condition.objects.filter(pk=old.pk).exists())
+        self.poll.refresh_from_db()
+        self.assertGreater(self.poll.version, version)
+        self.client.post(url, {"version": version, f"condition_{third.id}_{show.id}": "show"})
+        self.client.post(url, {"version": self.poll.version, f"condition_{first.id}_{later.id}": "show"})
+        self.assertEqual(Condition.objects.filter(question__poll=self.poll).count(), 2)
+        other_question = Question.objects.filter(poll=self.other).first()
+        for question_id in [other_question.id, 0]:
+            response = self.client.post(url, {"version": self.poll.version,
+                                              f"condition_{question_id}_{show.id}": "show"})
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse(Condition.objects.filter(question__poll=self.other).exists())
+        self.assertEqual(Condition.objects.filter(question__poll=self.poll).count(), 2)
+
+
+@override_settings(POLLS_LIVE_INTERVAL=0.01)
+class LiveResultsTest(TestCase):
+    """Поток счетчиков опроса"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('live_staff', is_staff=True)
+        cls.poll, cls.questions = create_poll('live', 2)
+        rebuild_counters(cls.poll)
+
+    async def events(self, stream, number):
+        """Первые number событий потока, комментарии keepalive пропускаются"""
+        events = []
+        async for chunk in stream:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            if chunk.startswith('event: '):
+                name, data = chunk.split('\n')[:2]
+                events.append((name.removeprefix('event: '), json.loads(data.removeprefix('data: '))))
+                if len(events) == number:
+                    return events
+        return events
+
+    async def test_snapshot_and_updates(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('polls:live', args=[self.poll.id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        [(name, snapshot)] = await self.events(stream, 1)
+        self.assertEqual((name, snapshot['answers']), ('counts', 0))
+        question, choices = self.questions[0]
+        await sync_to_async(save_answers)(self.poll.id, self.staff, question, [choices[1]])
+        [(name, counts)] = await self.events(stream, 1)
+        self.assertEqual(counts['answers'], 1)
+        self.assertEqual(counts['choices'][str(choices[1].id)], 1)
+        reader = asyncio.create_task(self.events(stream, 1))
+        await asyncio.sleep(0.05)
+        reader.cancel()  # Так ASGI-обработчик Django останавливает поток, когда клиент отключился
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertNotIn(self.poll.id, live._channels)
+
+    async def test_watchers_share_reads(self):
+        reads, read_counts = [], live.read_counts
+
+        def counting_read(poll_id, answers=None):
+            reads.append(answers)
+            return read_counts(poll_id, answers)
+
+        with patch.object(live, 'read_counts', counting_read):
+            streams = [aiter(live.stream_counts(self.poll.id)) for _ in range(5)]
+            for stream in streams:
+                await self.events(stream, 1)
+            await asyncio.sleep(0.1)
+            for stream in streams:
+                await stream.aclose()
+        self.assertEqual(reads[0], None)  # Текущие счетчики прочитаны один раз для всех потоков
+        self.assertEqual(reads.count(None), 1)
+        self.assertLess(len(reads), 0.1 / 0.01 + 3)  # По чтению за интервал, а не за интервал на поток
+        self.assertEqual(live._channels, {})
+
+    @override_settings(POLLS_LIVE_KEEPALIVE=0.01, POLLS_LIVE_IDLE_TIMEOUT=0.05)
+    async def test_idle_stream_is_closed(self):
+        events = await self.events(live.stream_counts(self.poll.id), 3)
+        self.assertEqual([name for name, _ in events], ['counts', 'idle'])
+        self.assertEqual(live._channels, {})
+
+    def test_access(self):
+        self.client.force_login(User.objects.create_user('live_user'))
+        self.assertEqual(self.client.get(reverse('polls:live', args=[self.poll.id])).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('polls:live', args=[self.poll.id])).status_code, 404)  # WSGI
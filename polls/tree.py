@@ -0,0 +1,184 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+from django.core.exceptions import ValidationError
+from .models import Question, Choice, Condition
+import logging
+
+logger = logging.getLogger("polls")
+
+
+@dataclass(frozen=True, slots=True)
+class QuestionNode:
+    """
+    Вопрос в скомпилированном дереве опроса. show и hide - множества id choices, условия которых
+    показывают или скрывают вопрос, choices - варианты ответа на сам вопрос.
+    """
+    id: int
+    default: bool
+    single: bool
+    choices: frozenset
+    show: frozenset
+    hide: frozenset
+
+    def is_visible(self, chosen):
+        """Видим ли вопрос при выбранных choices. Условие "скрыть" приоритетнее условия "показать"."""
+        if not self.hide.isdisjoint(chosen):
+            return False
+        if not self.show.isdisjoint(chosen):
+            return True
+        return self.default
+
+
+@dataclass(frozen=True, slots=True)
+class PollTree:
+    """
+    Неизменяемое дерево опроса: вопросы, упорядоченные по id, и условия их показа.
+    Строится по версии опроса, поэтому устаревшее дерево определяется без запросов в базу.
+    Индекс достижимости: suffix_default[i] - есть ли вопросы по умолчанию начиная с i-го,
+    suffix_show[i] - choices, которые показывают вопросы начиная с i-го, dead - id вопросов,
+    которые не могут быть показаны ни при каких ответах.
+    """
+    poll_id: int
+    version: int
+    questions: tuple
+    ids: tuple
+    suffix_default: tuple
+    suffix_show: tuple
+    dead: frozenset
+
+    def next_question(self, question_id, chosen):
+        """Возвращает id следующего за question_id вопроса для показа или None, если опрос закончился."""
+        for index in range(bisect_right(self.ids, question_id), len(self.questions)):
+            if not self.suffix_default[index] and self.suffix_show[index].isdisjoint(chosen):
+                break  # Ни один из оставшихся вопросов не может быть показан
+            node = self.questions[index]
+            if node.is_visible(chosen):
+                logger.debug(f'Show question_{node.id}. Found in poll tree')
+                return node.id
+        return None
+
+    @property
+    def max_path_length(self):
+        """Верхняя оценка числа вопросов, которые может увидеть пользователь"""
+        return len(self.questions) - len(self.dead)
+
+    def progress(self, question_id, chosen):
+        """
+        (номер вопроса question_id у пользователя, верхняя оценка числа вопросов в его опросе).
+        Номер считается по вопросам до question_id, на которые выбраны choices.
+        """
+        index = bisect_right(self.ids, question_id) - 1
+        answered = sum(1 for node in self.questions[:max(index, 0)] if not node.choices.isdisjoint(chosen))
+        remaining = sum(1 for node in self.questions[max(index, 0):] if node.id not in self.dead)
+        return answered + 1, answered + max(remaining, 1)
+
+    def replay(self, submitted):
+        """
+        Проходит опрос по ответам submitted ({question_id: set(choice_ids)}) так же, как при ответах по одному
+        вопросу. Возвращает список (QuestionNode, choice_ids) показанных вопросов, ответы на скрытые
+        вопросы не учитываются.
+        """
+        chosen = set()
+        path = []
+        for node in self.questions:
+            if not node.is_visible(chosen):
+                continue
+            answer = submitted.get(node.id, set())
+            if len(answer) == 0:
+                raise ValidationError(f'No choices were selected for question_{node.id}.')
+            if not answer <= node.choices:
+                raise ValidationError(f'Not all choices from question_{node.id}.')
+            if node.single and len(answer) > 1:
+                raise ValidationError(f'Multiple choices for question_{node.id} with single choice.')
+            chosen |= answer
+            path.append((node, answer))
+        return path
+
+    def as_dict(self):
+        """Правила показа вопросов для браузера"""
+        return {"questions": [
+            {"id": node.id, "default": node.default, "show": sorted(node.show), "hide": sorted(node.hide)}
+            for node in self.questions
+        ]}
+
+
+def compile_poll_tree(poll):
+    """Строит дерево опроса за три запроса"""
+    return compile_poll_trees([poll])[poll.id]
+
+
+def compile_poll_trees(polls):
+    """Строит деревья опросов {poll_id: PollTree} за три запроса для любого числа опросов"""
+    polls = {poll.id: poll for poll in polls}
+    show, hide, choices = {}, {}, {}
+    for choice_id, question_id in Choice.objects.filter(question__poll__in=polls).values_list('id', 'question_id'):
+        choices.setdefault(question_id, set()).add(choice_id)
+    conditions = Condition.objects.filter(question__poll__in=polls).values_list('question_id', 'choice_id',
+                                                                                'condition_type')
+    for question_id, choice_id, condition_type in conditions:
+        (show if condition_type else hide).setdefault(question_id, set()).add(choice_id)
+    questions = {poll_id: [] for poll_id in polls}
+    for question_id, poll_id, default, choice_type in (Question.objects.filter(poll__in=polls).order_by('id')
+                                                       .values_list('id', 'poll_id', 'default', 'choice_type')):
+        questions[poll_id].append(QuestionNode(
+            id=question_id, default=default, single=choice_type == 0,
+            choices=frozenset(choices.get(question_id, ())), show=frozenset(show.get(question_id, ())),
+            hide=frozenset(hide.get(question_id, ()))))
+    trees = {}
+    for poll_id, nodes in questions.items():
+        nodes = tuple(nodes)
+        suffix_default, suffix_show = reachability_index(nodes)
+        trees[poll_id] = PollTree(poll_id=poll_id, version=polls[poll_id].version, questions=nodes,
+                                  ids=tuple(node.id for node in nodes), suffix_default=suffix_default,
+                                  suffix_show=suffix_show, dead=dead_questions(nodes))
+    return trees
+
+
+def reachability_index(questions):
+    """
+    Для каждой позиции i: есть ли вопросы по умолчанию среди вопросов начиная с i-го и объединение
+    их choices "показать". Если вопросов по умолчанию нет и ни один из этих choices не выбран,
+    дальше показывать нечего.
+    """
+    suffix_default, suffix_show = [False], [frozenset()]
+    for node in reversed(questions):
+        suffix_default.append(suffix_default[-1] or node.default)
+        suffix_show.append(suffix_show[-1] | node.show if node.show else suffix_show[-1])
+    return tuple(reversed(suffix_default)), tuple(reversed(suffix_show))
+
+
+def dead_questions(questions):
+    """
+    id вопросов, которые не могут быть показаны: не показываются по умолчанию и их не показывает
+    ни один choice вопроса, который может быть показан, либо их скрывает любой ответ на вопрос,
+    который показывается всегда.
+    """
+    dead = set()
+    reachable_choices = set()
+    always_visible = []  # Вопросы по умолчанию без условий "скрыть"
+    for node in questions:
+        hidden = any(other.choices <= node.hide for other in always_visible)
+        if hidden or not (node.default or not node.show.isdisjoint(reachable_choices)):
+            dead.add(node.id)
+            continue
+        reachable_choices |= node.choices
+        if node.default and not node.hide and node.choices:
+            always_visible.append(node)
+    return frozenset(dead)
+
+
+_trees = {}
+
+
+def get_poll_tree(poll):
+    """Возвращает дерево опроса из кэша процесса, перестраивая его, если версия опроса изменилась"""
+    tree = _trees.get(poll.id)
+    if tree is None or tree.version != poll.version:
+        tree = compile_poll_tree(poll)
+        _trees[poll.id] = tree
+        logger.debug(f'Compile tree of poll_{poll.id}, version {poll.version}')
+    return tree
+
+
+def forget_poll_tree(poll_id):
+    _trees.pop(poll_id, None)
@@ -1,9 +1,19 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views, api
+
+# При запуске под ASGI опросы проходятся асинхронными views
+poll_views = async_views if settings.POLLS_ASYNC_VIEWS else views
 
 app_name = 'polls'
 urlpatterns = [
-    path('', views.PollsListView.as_view(), name='list'),
-    path('vote/<int:poll_id>', views.vote, name='vote'),
-    path('result/<int:poll_id>', views.result_poll, name='result'),
-]
\ No newline at end of file
+    path('', poll_views.PollsListView.as_view(), name='list'),
+    path('vote/<int:poll_id>', poll_views.vote, name='vote'),
+    path('result/<int:poll_id>', poll_views.result_poll, name='result'),
+    path('export/<int:poll_id>', views.export_results, name='export'),
+    path('live/<int:poll_id>', async_views.live_results, name='live'),
+    path('api/polls', api.polls_list, name='api_list'),
+    path('api/polls/<int:poll_id>', api.poll_definition, name='api_poll'),
+    path('api/polls/<int:poll_id>/answers', api.poll_answers, name='api_answers'),
+    path('api/polls/<int:poll_id>/result', api.poll_result, name='api_result'),
+]
@@ -1,18 +1,99 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.http import StreamingHttpResponse, Http404
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.generic import ListView
 from django.core.exceptions import BadRequest
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction, IntegrityError
+from django.db.models import Exists, OuterRef, Q, Prefetch, QuerySet
 from .models import *
+from .tree import get_poll_tree
+from .stats import count_answers, count_poll_answers
+from .export import FORMATS, export_poll
+from .fragments import question_fragment
+from .completions import completed_poll_ids
+from .journal import append_answers, with_pending, settle, flush_pending
+from .archive import collect_results
 import logging
 
 logger = logging.getLogger("polls")
 
 
+class KeysetPage:
+    """
+    Страница списка при постраничном выводе по ключу: страница выбирается условием на id после или до
+    граничного опроса, поэтому не нужен COUNT(*) по всему списку.
+    """
+    number = None
+
+    def __init__(self, rows, size, after, before):
+        if before is not None:
+            rows = rows[::-1]
+            self._has_previous, self._has_next = len(rows) > size, True
+            self.object_list = rows[-size:]
+        else:
+            self._has_previous, self._has_next = after is not None, len(rows) > size
+            self.object_list = rows[:size]
+        self.first_id = self.object_list[0].id if self.object_list else None
+        self.last_id = self.object_list[-1].id if self.object_list else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    @staticmethod
+    def slice(queryset, size, after, before):
+        """Запрос на size + 1 опросов, лишний опрос показывает, есть ли следующая страница"""
+        if before is not None:
+            return queryset.filter(id__lt=before).order_by('-id')[:size + 1]
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+        return queryset.order_by('id')[:size + 1]
+
+
+def keyset_params(request):
+    """Граничные id из after и before, нечисловое значение - ошибка запроса (400)"""
+    params = []
+    for name in ['after', 'before']:
+        value = request.GET.get(name)
+        try:
+            params.append(None if value is None else int(value))
+        except ValueError:
+            raise BadRequest(f"{name} must be a poll id.")
+    return params
+
+
+def page_urls(request, page):
+    """Ссылки на предыдущую и следующую страницы с сохранением остальных параметров"""
+    urls = []
+    for exists, params in [(page.has_previous(), {'before': page.first_id} if page.number is None
+                            else {'page': page.number - 1}),
+                           (page.has_next(), {'after': page.last_id} if page.number is None
+                            else {'page': page.number + 1})]:
+        if not exists:
+            urls.append(None)
+            continue
+        query = request.GET.copy()
+        for name in ['page', 'after', 'before']:
+            query.pop(name, None)
+        query.update(params)
+        urls.append(f'?{query.urlencode()}')
+    return urls
+
+
 class PollsListView(LoginRequiredMixin, ListView):
     """
     ListView для списка пройденных и непройденных опросов. done управляет какие именно будут показываться.
+    При settings.POLLS_LIST_PAGINATION = "keyset" страницы выбираются по ключу без подсчета всех опросов.
     """
     paginate_by = 5
     model = Poll
@@ -26,23 +107,41 @@ class PollsListView(LoginRequiredMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["done"] = self.done
+        context["previous_url"], context["next_url"] = page_urls(self.request, context["page_obj"])
         return context
 
     def get_queryset(self):
-        if self.done:
-            return Poll.objects.filter(
-                id__in=PollResult.objects.filter(user=self.request.user).values_list('poll', flat=True))
-        else:
-            return Poll.objects.filter(visibility=True).exclude(
-                id__in=PollResult.objects.filter(user=self.request.user).values_list('poll', flat=True))
+        return polls_queryset(self.request.user, self.done).order_by('id')
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.POLLS_LIST_PAGINATION != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+        after, before = keyset_params(self.request)
+        page = KeysetPage(list(KeysetPage.slice(queryset, page_size, after, before)), page_size, after, before)
+        return None, page, page.object_list, page.has_previous() or page.has_next()
+
+
+def polls_queryset(user, done):
+    """Пройденные (done) или доступные пользователю опросы"""
+    if settings.POLLS_CACHE_COMPLETED_POLLS:
+        completed = completed_poll_ids(user)
+    else:
+        completed = PollResult.objects.filter(user=user).values_list('poll', flat=True)
+    if done:
+        return Poll.objects.filter(id__in=completed)
+    else:
+        return Poll.objects.filter(visibility=True).exclude(id__in=completed)
 
 
 def search_next_question(questions, answers):
-    """Функция поиска следующего вопроса по ответам пользователя на предыдущие вопросы в рамках одного опроса"""
+    """
+    Функция поиска следующего вопроса по ответам пользователя на предыдущие вопросы в рамках одного опроса.
+    answers - ответы пользователя или список id выбранных choices.
+    """
     current_question = None
+    chosen = answers.values_list('choice', flat=True) if isinstance(answers, QuerySet) else answers
     for question in questions:
-        conditions = Condition.objects.filter(choice__in=answers.values_list('choice', flat=True),
-                                              question=question)
+        conditions = Condition.objects.filter(choice__in=chosen, question=question)
         conditions_num = conditions.count()
         if conditions_num == 0:  # Условий не нашли, поведение по умолчанию
             if question.default:
@@ -78,72 +177,225 @@ def search_next_question(questions, answers):
     return current_question
 
 
+def search_next_question_sql(poll_id, question_id, result):
+    """
+    Поиск следующего вопроса одним запросом. Правила те же, что и в search_next_question:
+    условие "скрыть" приоритетнее условия "показать", без условий используется поведение по умолчанию.
+    """
+    # Ответы из журнала есть только в result.choices
+    chosen = result.choices if result.pending_choices else Answer.objects.filter(poll_result=result).values('choice')
+    conditions = Condition.objects.filter(question=OuterRef('pk'), choice__in=chosen)
+    return Question.objects.filter(
+        ~Exists(conditions.filter(condition_type=False)),
+        Exists(conditions.filter(condition_type=True)) | Q(default=True),
+        poll_id=poll_id, pk__gt=question_id,
+    ).order_by('id').first()
+
+
+def find_next_question(poll, question_id, result):
+    """Поиск следующего за question_id вопроса способом из settings.POLLS_NEXT_QUESTION_ENGINE"""
+    engine = settings.POLLS_NEXT_QUESTION_ENGINE
+    if engine == 'tree':
+        current_question_id = get_poll_tree(poll).next_question(question_id, set(result.choices))
+        return None if current_question_id is None else Question.objects.get(pk=current_question_id)
+    if engine == 'sql':
+        return search_next_question_sql(poll.id, question_id, result)
+    if engine == 'loop':
+        questions = Question.objects.filter(poll=poll, pk__gt=question_id)
+        answers = result.choices if result.pending_choices else Answer.objects.filter(poll_result=result)
+        return search_next_question(questions, answers)
+    raise ImproperlyConfigured(f'Unknown POLLS_NEXT_QUESTION_ENGINE: {engine}')
+
+
+def save_answers(poll_id, user, question, choices):
+    """
+    Сохраняет ответы на вопрос, прогресс опроса и счетчики статистики одной транзакцией. Повторный ответ
+    на вопрос с одним вариантом ответа отклоняет ограничение unique_single_answer.
+    """
+    with transaction.atomic():
+        result, created = PollResult.objects.select_for_update().get_or_create(poll_id=poll_id, user=user)
+        previous = set() if created else set(
+            Answer.objects.filter(poll_result=result, question=question).values_list('choice_id', flat=True))
+        answers = [Answer(poll_result=result, choice=choice, question=question, single=question.choice_type == 0)
+                   for choice in choices if choice.id not in previous]
+        if len(answers) == 0:
+            logger.debug(f'Answers to question_{question.id} are already saved')
+            return result
+        try:
+            with transaction.atomic():
+                Answer.objects.bulk_create(answers)
+        except IntegrityError:
+            logger.error(f"Bad answer. Error: pollresult_{result.id}, question_{question.id}, "
+                         f"message: Question with single choice already have answer.")
+            return result
+        choices_ids = [answer.choice_id for answer in answers]
+        count_answers(poll_id, question.id, choices_ids, new_result=len(result.choices) == 0,
+                      new_question=len(previous) == 0, last_question_id=result.current_question_id)
+        if result.current_question_id is None or question.id > result.current_question_id:
+            result.current_question = question
+        result.choices = result.choices + choices_ids
+        result.finished = False
+        result.snapshot = None  # Ответы изменились, сохраненные результаты устарели
+        result.save(update_fields=['current_question', 'choices', 'finished', 'snapshot'])
+    return result
+
+
+def finish_poll(result):
+    """
+    Отмечает опрос завершенным и сохраняет результаты, чтобы страница результатов читала одну строку
+    """
+    result.finished = True
+    if settings.POLLS_RESULT_SNAPSHOTS and result.snapshot is None:
+        result.snapshot = result.collect_results()
+    result.save(update_fields=['finished', 'snapshot'])
+
+
+def submit_poll(poll, user, submitted):
+    """
+    Проверяет ответы на весь опрос (submitted - {question_id: set(choice_ids)}) проходом по дереву опроса
+    и сохраняет их одной транзакцией.
+    """
+    path = get_poll_tree(poll).replay(submitted)
+    if len(path) == 0:
+        raise ValidationError('Poll has no questions to answer.')
+    with transaction.atomic():
+        result, created = PollResult.objects.select_for_update().get_or_create(poll=poll, user=user)
+        if len(result.choices) != 0:
+            raise ValidationError('Poll was already answered.')
+        Answer.objects.bulk_create(
+            Answer(poll_result=result, choice_id=choice_id, question_id=node.id, single=node.single)
+            for node, choices_ids in path for choice_id in sorted(choices_ids)
+        )
+        count_poll_answers(poll.id, [(node.id, choices_ids) for node, choices_ids in path])
+        result.current_question_id = path[-1][0].id
+        result.choices = [choice_id for _, choices_ids in path for choice_id in sorted(choices_ids)]
+        result.save(update_fields=['current_question', 'choices'])
+        finish_poll(result)
+    return result
+
+
+def vote_page(request, poll):
+    """
+    Весь опрос на одной странице. Вопросы показываются и скрываются в браузере по правилам дерева опроса,
+    ответы приходят одним POST.
+    """
+    selected = set()
+    if request.method == 'POST':
+        submitted = {int(key.removeprefix('question_')): {int(value) for value in request.POST.getlist(key)}
+                     for key in request.POST if key.startswith('question_')}
+        try:
+            submit_poll(poll, request.user, submitted)
+        except ValidationError as e:
+            logger.debug(f"Bad poll answers: {' '.join(e.messages)}")
+            messages.error(request, "Please answer all shown questions and vote again")
+            selected = {choice_id for choices_ids in submitted.values() for choice_id in choices_ids}
+        else:
+            return redirect(f"/polls/result/{poll.id}")
+    elif PollResult.objects.filter(poll=poll, user=request.user, finished=True).exists():
+        return redirect(f"/polls/result/{poll.id}")
+    questions = Question.objects.filter(poll=poll).prefetch_related(
+        Prefetch('choice_set', queryset=Choice.objects.order_by('id')))
+    context = {"poll": poll, "questions": questions, "tree": get_poll_tree(poll).as_dict(), "selected": selected}
+    return render(request, "polls/vote_page.html", context)
+
+
+def question_progress(poll, question, result):
+    """Номер вопроса у пользователя и верхняя оценка числа вопросов в его опросе"""
+    return get_poll_tree(poll).progress(question.id, set() if result is None else set(result.choices))
+
+
+def submitted_choices_ids(data):
+    """id choices из формы вопроса"""
+    return [int(value) for key, value in data.items() if key.startswith('checkbox_') or key == 'radio']
+
+
 @login_required()
 def vote(request, poll_id):
     poll = get_object_or_404(Poll, pk=poll_id, visibility=True)
+    if poll.single_page:
+        return vote_page(request, poll)
     if request.method == 'GET':
         prev_question_id = request.GET.get('question')
         invalid = request.GET.get('invalid')
-        if prev_question_id is None:    # Показываем первый вопрос
-            questions = Question.objects.filter(poll_id=poll_id, default=True)[:1]
-            current_question = questions[0]
-            logger.debug(f'Show first question_{current_question.id}')
-        elif invalid is not None:   # Предыдущий ответ был плохой, повторяем вопрос еще раз
-            current_question = get_object_or_404(Question, pk=int(prev_question_id))
+        if prev_question_id is not None and invalid is not None:   # Предыдущий ответ был плохой, повторяем вопрос еще раз
+            current_question = get_object_or_404(Question, pk=int(prev_question_id), poll_id=poll_id)
             logger.debug(f'Re-vote question_{prev_question_id}')
+            progress = None
         else:
-            questions = Question.objects.filter(poll_id=poll_id, pk__gt=int(prev_question_id))
-            if questions.count() == 0:  # Вопросы закончились, завершаем опрос, показываем результат
-                logger.debug('Finish vote. No more questions')
-                return redirect(f"/polls/result/{poll_id}")
-            result = get_object_or_404(PollResult, poll_id=poll_id, user=request.user)
-            answers = Answer.objects.filter(poll_result=result)
-            current_question = search_next_question(questions, answers)
-            if current_question is None:  # Не нашли подходящего вопроса для показа, завершаем опрос, показываем результат
-                logger.debug('Finish vote. No questions to show.')
+            result = PollResult.objects.filter(poll_id=poll_id, user=request.user).first()
+            if settings.POLLS_ANSWER_JOURNAL:
+                result = with_pending(poll, request.user, result)
+            if result is not None and result.finished:  # Опрос уже пройден, показываем результат
+                logger.debug('Vote is already finished.')
                 return redirect(f"/polls/result/{poll_id}")
-        context = {"question": current_question}
+            if prev_question_id is None and (result is None or result.current_question_id is None):
+                questions = Question.objects.filter(poll_id=poll_id, default=True)[:1]   # Показываем первый вопрос
+                current_question = questions[0]
+                logger.debug(f'Show first question_{current_question.id}')
+            else:
+                if result is None:
+                    raise Http404('No poll result.')
+                # Без номера вопроса продолжаем прерванный опрос с последнего отвеченного вопроса
+                prev_question_id = result.current_question_id if prev_question_id is None else int(prev_question_id)
+                current_question = find_next_question(poll, prev_question_id, result)
+                if current_question is None:  # Не нашли подходящего вопроса для показа, завершаем опрос, показываем результат
+                    logger.debug('Finish vote. No questions to show.')
+                    result = settle(result)
+                    result.poll = poll  # Опрос уже загружен, collect_results не запрашивает его еще раз
+                    finish_poll(result)
+                    return redirect(f"/polls/result/{poll_id}")
+            progress = question_progress(poll, current_question, result)
+        context = {"poll": poll, "question": current_question, "progress": progress,
+                   "fragment": question_fragment(poll, current_question)}
         return render(request, "polls/vote.html", context)
     elif request.method == 'POST':
         question_id = request.POST.get('question')
         if question_id is None:
             raise BadRequest("No question was provided.")
         question_id = int(question_id)
-        question = get_object_or_404(Question, pk=question_id)
+        question = get_object_or_404(Question, pk=question_id, poll_id=poll_id)
         redirect_url = f"/polls/vote/{poll_id}?question={question_id}"
-        choices_ids = []
-        for key, value in request.POST.items():
-            if key.startswith('checkbox_') or key == 'radio':
-                choices_ids.append(int(value))
+        choices_ids = submitted_choices_ids(request.POST)
         if len(choices_ids) == 0:   # Не переданы choices
             messages.error(request, "No choices were selected. Please vote again")
             logger.debug('No choices were selected.')
             return redirect(redirect_url + "&invalid=1")
-        choices = Choice.objects.filter(id__in=choices_ids)
-        if choices.count() == 0 or not question.belong_all(choices):    # Переданы плохие choices
+        choices = list(Choice.objects.filter(id__in=choices_ids, question=question))
+        if len(choices) != len(set(choices_ids)):    # Переданы плохие choices
             logger.error('Not all choices from current question.')
             return redirect(redirect_url + "&invalid=1")
-        result, created = PollResult.objects.get_or_create(poll_id=poll_id, user=request.user)
-        for choice in choices:
-            answer = Answer(poll_result=result, choice=choice)
-            try:
-                answer.full_clean()     # Валидация answer
-            except ValidationError as e:
-                logger.error(
-                    f"Bad answer. Error: pollresult_{result.id}, choice_{choice.id}, message: {' '.join(e.messages)}")
-                continue
-            else:
-                answer.save()
+        if question.choice_type == 0 and len(choices) > 1:
+            logger.error('Multiple choices for question with single choice.')
+            return redirect(redirect_url + "&invalid=1")
+        if settings.POLLS_ANSWER_JOURNAL:
+            append_answers(poll_id, request.user.id, question, choices_ids)
+        else:
+            save_answers(poll_id, request.user, question, choices)
         return redirect(redirect_url)
 
 
 @login_required()
 def result_poll(request, poll_id):
-    result = get_object_or_404(PollResult, poll_id=poll_id, user=request.user)
-    questions = result.ansvered_questions
-    questions_dict = {}
-    for question in questions:
-        answers = Answer.objects.filter(poll_result=result, choice__question=question)
-        questions_dict[question] = answers.values_list('choice_id', flat=True)
-    context = {"poll_name": result.poll.name, "questions": questions_dict}
+    if settings.POLLS_ANSWER_JOURNAL:
+        flush_pending(poll_id, request.user.id)
+    result = get_object_or_404(PollResult.objects.select_related('poll'), poll_id=poll_id, user=request.user)
+    results = result.snapshot
+    if results is None:
+        results = collect_results(result)
+    context = {"poll_name": results["poll_name"], "questions": results["questions"]}
     return render(request, "polls/poll_result.html", context)
+
+
+@staff_member_required
+def export_results(request, poll_id):
+    """Потоковая выгрузка ответов на опрос. Параметры: format=csv|ndjson, gzip=1"""
+    poll = get_object_or_404(Poll, pk=poll_id)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        raise BadRequest(f"Unknown format {export_format}.")
+    compress = request.GET.get('gzip') == '1'
+    filename = f"poll_{poll.id}.{export_format}" + (".gz" if compress else "")
+    response = StreamingHttpResponse(export_poll(poll, export_format, compress),
+                                     content_type="application/gzip" if compress else FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,32 @@
+// Показ и скрытие вопросов опроса по тем же правилам, что и polls.tree.QuestionNode.is_visible:
+// условие "скрыть" приоритетнее условия "показать", без условий используется поведение по умолчанию.
+function is_visible(question, chosen) {
+ if (question.hide.some(id => chosen.has(id))) {
+  return false;
+ }
+ if (question.show.some(id => chosen.has(id))) {
+  return true;
+ }
+ return question.default;
+}
+
+// Учитываются только ответы на показанные вопросы, скрытые вопросы отключаются и не отправляются.
+function update_questions(tree) {
+ let chosen = new Set();
+ for (const question of tree.questions) {
+  let fieldset = document.getElementById("question_" + question.id);
+  let visible = is_visible(question, chosen);
+  fieldset.hidden = !visible;
+  fieldset.disabled = !visible;
+  if (visible) {
+   for (const input of fieldset.querySelectorAll("input:checked")) {
+    chosen.add(Number(input.value));
+   }
+  }
+ }
+}
+
+function init_poll_page(tree) {
+ document.getElementById("pollForm").addEventListener("change", () => update_questions(tree));
+ update_questions(tree);
+}
@@ -0,0 +1,67 @@
+"""
+Нагрузочный замер работающего сервера: входит пользователем и запрашивает страницы в несколько потоков,
+печатает в JSON перцентили времени ответа и запросы в секунду по каждой странице.
+Пример: python utils/http_benchmark.py http://localhost:8000 --user polmarina --password v0X4imrH
+"""
+import argparse
+import json
+import math
+import re
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+
+def login(base_url, username, password):
+    """Входит через форму /login/ и возвращает заголовок Cookie с сессией"""
+    cookies = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+    page = opener.open(base_url + '/login/').read().decode()
+    token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', page).group(1)
+    data = urllib.parse.urlencode({"username": username, "password": password, "csrfmiddlewaretoken": token})
+    opener.open(urllib.request.Request(base_url + '/login/', data=data.encode(),
+                                       headers={"Referer": base_url + '/login/'}))
+    if not any(cookie.name == 'sessionid' for cookie in cookies):
+        raise SystemExit('Login failed.')
+    return '; '.join(f'{cookie.name}={cookie.value}' for cookie in cookies)
+
+
+def fetch(url, cookie):
+    start = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, headers={"Cookie": cookie})) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base_url')
+    parser.add_argument('--user', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--paths', nargs='+', default=['/polls/', '/polls/?done=1', '/static/main.js'])
+    parser.add_argument('--requests', type=int, default=500, help="Запросов на каждую страницу")
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    base_url = args.base_url.rstrip('/')
+    cookie = login(base_url, args.user, args.password)
+    report = {}
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for path in args.paths:
+            start = time.perf_counter()
+            times = [elapsed * 1000 for elapsed in
+                     executor.map(lambda _: fetch(base_url + path, cookie), range(args.requests))]
+            seconds = time.perf_counter() - start
+            report[path] = {"requests_per_second": round(args.requests / seconds, 1),
+                            **{f"p{q}_ms": round(percentile(times, q), 2) for q in (50, 90, 99)}}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()